@@ -1,4 +1,7 @@
 __version__ = "0.1.0"
 
-from .bot import Bot
+from .bot import Bot, AccessTokenError
+from .server import Server, HttpServer
+from .manager import BotManager
+from .shard import ShardedBot
 from .qzone import Qzone, QzoneImage
@@ -1,242 +1,462 @@
 import asyncio
 import inspect
-import json
+import itertools
 
 import logging
-import sys
-from typing import Callable, Type
-import uuid
+import time
+from typing import Callable, Hashable, Type
+import weakref
+import httpx
 import websockets
 
 import botx.logging
 from botx.models import *
+from botx.models.decoder import decode
 from botx.models.notice import notices
 from botx.models.request import requests
 from botx.qzone import Qzone
 from botx.guild import Guild
+from botx.http import make_transport
+from botx.cache import MessageCache, TTLCache
+from botx.codec import Codec, get_codec
+from botx.dispatch import EventQueue
+from botx.executor import Handler, HandlerExecutor, SerialExecutor
+from botx.scheduler import Scheduler
+from botx.receipt import ReadReceipts
 
 _instances: dict[int, "Bot"] = {}
+# 已经启动的 Bot, 用于分发不属于任何一个 Bot 的异常
+_bots: "weakref.WeakSet[Bot]" = weakref.WeakSet()
+
+
+class AccessTokenError(Exception):
+    """ Onebot 返回 retcode 1403, 这个账号无法继续运行, 只会停止这一个 Bot """
 
 
 def get_bot(id: int) -> "Bot | None":
     return _instances.get(id)
 
 
+def _chat_key(msg: Message) -> str:
+    return f"g{msg.group_id}" if isinstance(msg, GroupMessage) else f"p{msg.sender.user_id}"
+
+
+def _serial_key(serial: bool | Callable[[Message], Hashable]) -> Callable[[Message], Hashable] | None:
+    return _chat_key if serial is True else serial or None
+
+
+def _leading_text(message: str | list | dict) -> str | None:
+    # 不转换成 MessageChain, 只看第一段; 字符串格式的 CQ 码以 "[" 开头, 不会匹配到指令前缀
+    if isinstance(message, str):
+        return message
+    if isinstance(message, list) and message and message[0]["type"] == "text":
+        return message[0]["data"]["text"]
+    return None
+
+
+def _serialize(msg: str | dict | MessageSegment | MessageChain) -> str | dict | list:
+    if isinstance(msg, MessageChain):
+        return msg.to_array()
+    if isinstance(msg, MessageSegment):
+        return [msg.to_dict()]
+    return msg
+
+
+def _exception_handler(loop: asyncio.AbstractEventLoop, context: dict):
+    # 一个事件循环只有一个异常处理器, 多个 Bot 共用时按 context 中的 bot 分发
+    bot = context.get("bot")
+    for b in [bot] if bot != None else list(_bots):
+        b._on_error(loop, context)
+
+
 class Bot:
-    ws_uri: str
+    ws_uri: str | None
     __token: str | None
     
     cmd_prefix: list[str]
     me: User
     msg_cd: float
+    scheduler: Scheduler
+    codec: Codec
+    offload_size: int
+    workers: int | None
+    events: EventQueue | None
+    executor: HandlerExecutor
+    serial: SerialExecutor
+    api_timeout: float | None
+    messages: MessageCache
+    info: TTLCache
+    http_transport: httpx.AsyncBaseTransport | None
     log_level: str
     __running: bool = False
+    __workers: list[asyncio.Task] | None
+    __slots: asyncio.Semaphore | None
+    """ workers 的并发上限, 由 worker 和轮到自己的串行调用共用 """
+    __throttled: int
+    """ 还在限速队列里排队的调用数 """
     __queue: asyncio.Queue
     __futures: dict[str, asyncio.Future]
+    __echo: itertools.count
     __commands: list[Command]
-    __cmd_names: list[str]
-    __notice_handlers: dict[Type[Notice], list[Callable]]
-    __message_handlers: dict[Type[Message], list[Callable]]
-    __request_handlers: dict[Type[Request], list[Callable]]
+    __cmd_prefixes: tuple[str, ...]
+    __cmd_index: dict[str, dict[Type[Message], list[Command]]]
+    __cmd_targets: dict[Type[Message], set[int]]
+    __help_cache: dict[tuple[Type[Message], int | None], str]
+    __notice_routes: dict[tuple[str, str | None], dict[Type[Notice], list[Handler]]]
+    __message_handlers: dict[Type[Message], list[Handler]]
+    __request_routes: dict[tuple[str, str | None], dict[Type[Request], list[Handler]]]
     __error_handlers: list[Callable]
+    __receipts: ReadReceipts
     __online: bool
     __tasks: dict[str, dict]
+    __qzone: Qzone | None
+    __guild: Guild | None
+    __session_lock: asyncio.Lock
 
     def __init__(
         self, 
-        ws_uri: str, 
+        ws_uri: str | None = None, 
         *, 
         token: str | None = None, 
         cmd_prefix: list[str] = ["#", "＃"], 
         msg_cd: float = 0.1, 
+        scheduler: Scheduler | None = None,
+        read_receipt: float | None = 1,
+        codec: Codec | str = "json",
+        offload_size: int = 1 << 20,
+        workers: int | None = None,
+        max_events: int = 10000,
+        overflow: str = "drop_oldest",
+        executor: HandlerExecutor | None = None,
+        serial_queue: int = 100,
+        api_timeout: float | None = 60,
+        msg_cache: int = 10000,
+        msg_cache_bytes: int = 64 << 20,
+        info_ttl: float = 300,
+        info_cache: int = 10000,
+        http_transport: httpx.AsyncBaseTransport | None = None,
         log_level = "INFO"
     ):
+        """
+        ws_uri: Onebot 的正向 Websocket 地址, 使用 botx.server 接收连接时可以不填
+        msg_cd: 同一个群 / 私聊里两条消息之间的最小间隔
+        scheduler: 自定义发送调度器, 指定后忽略 msg_cd
+        read_receipt: 已读回执的合并窗口(秒), 为 None 时不标记已读
+        codec: Websocket 使用的 JSON 实现, 可以是 json / orjson / msgspec / auto
+        offload_size: 超过该字节数的帧放到线程里解码, 避免阻塞事件循环
+        workers: 处理事件的协程数, 为 None 时每个事件单独创建一个 Task (不限制并发)
+        max_events: 指定 workers 后排队事件的上限
+        overflow: 队列满时的策略, 见 EventQueue. 注意 block 会暂停读取 Websocket,
+            处理函数里 call_api 的响应也会被挡住, workers 需要留有余量
+        executor: 运行同步处理函数的线程池, 默认为每个 Bot 新建一个
+        serial_queue: serial 处理函数在每个群 / 私聊里最多排队的事件数, 超出时丢掉最早的
+        api_timeout: call_api 的默认超时时间(秒), 包括在限速队列里等待的时间, 为 None 时一直等待
+        msg_cache, msg_cache_bytes: get_msg 缓存的最大条数和估算的最大字节数, msg_cache 为 0 时不缓存
+        info_ttl, info_cache: 群 / 群成员 / 用户信息的缓存时间(秒)和最大条数, info_cache 为 0 时不缓存
+        http_transport: Qzone / Guild 使用的 HTTP 连接池, 多个账号可以共用一个, 默认在第一次使用时创建
+        """
         self.ws_uri = ws_uri
         self.__token = token
 
         self.cmd_prefix = cmd_prefix
+        # 长前缀优先匹配, 避免 "##" 被 "#" 截断
+        self.__cmd_prefixes = tuple(sorted(cmd_prefix, key=len, reverse=True))
         self.me = None
         self.__queue = asyncio.Queue()
         self.__futures = {}
+        self.__echo = itertools.count()
         self.__commands = []
-        self.__cmd_names = []
-        self.__notice_handlers = {}
+        self.__cmd_index = {}
+        self.__cmd_targets = {PrivateMessage: set(), GroupMessage: set()}
+        self.__help_cache = {}
+        self.__notice_routes = {}
         self.__message_handlers = {}
-        self.__request_handlers = {}
+        self.__request_routes = {}
         self.__error_handlers = []
+        self.__receipts = ReadReceipts(self.__mark_read, window=read_receipt)
         self.__online = True
         self.__tasks = {}
+        self.__workers = None
+        self.__slots = asyncio.Semaphore(workers) if workers else None
+        self.__throttled = 0
         self.msg_cd = msg_cd
+        self.scheduler = scheduler or Scheduler(rate=1 / msg_cd if msg_cd else None)
+        self.codec = get_codec(codec) if isinstance(codec, str) else codec
+        self.offload_size = offload_size
+        self.workers = workers
+        self.events = EventQueue(max_events, overflow) if workers else None
+        self.executor = executor or HandlerExecutor()
+        self.serial = SerialExecutor(serial_queue)
+        self.api_timeout = api_timeout
+        self.messages = MessageCache(msg_cache, msg_cache_bytes)
+        self.info = TTLCache(info_ttl, info_cache)
+        self.http_transport = http_transport
+        self.__qzone = None
+        self.__guild = None
+        self.__session_lock = asyncio.Lock()
         self.log_level = log_level
         
         @self.on_cmd("帮助", help_msg="给你看帮助的")
         async def help(msg: Message):
-            cmds = list(filter(lambda cmd: isinstance(msg, cmd.cmd_type) and cmd.is_target(msg), self.__commands))
-            if len(cmds) == 1:
-                await msg.reply("啥指令都没有呢~")
-                return
-            await msg.reply(f"✨指令列表\n\n" + "\n".join(map(lambda cmd: f"#{", #".join(cmd.names)}: {cmd.help_msg}", cmds)))
+            await msg.reply(self.__get_help(msg))
+
+        # 群成员变化后缓存的信息就过时了
+        @self.on_notice()
+        async def member_increase(notice: GroupIncrease):
+            self.info.invalidate(("group", notice.group_id))
+            self.info.invalidate(("member", notice.group_id, notice.user_id))
+
+        @self.on_notice()
+        async def member_decrease(notice: GroupDecrease):
+            self.info.invalidate(("group", notice.group_id))
+            if notice.sub_type == "kick_me":
+                self.info.invalidate_where(lambda k: k[0] == "member" and k[1] == notice.group_id)
+            else:
+                self.info.invalidate(("member", notice.group_id, notice.user_id))
+
+        @self.on_notice()
+        async def friend_add(notice: FriendAdd):
+            self.info.invalidate(("user", notice.user_id))
 
     async def start(self):
+        if self.ws_uri == None:
+            raise RuntimeError("没有指定 ws_uri, 请使用 botx.server 中的 Server 接收 Onebot 的连接")
         if self.__running == True:
             raise RuntimeError("该 Bot 实例已经被启动了!")
         self.__running = True
         self.getLogger().info("开始启动...")
-        
-        def error(loop: asyncio.AbstractEventLoop, context: dict):
-            self.getLogger().error(context)
-            data = self.__tasks.get(context["future"].get_name())
-            for h in self.__error_handlers:
-                if inspect.iscoroutinefunction(h):
-                    loop.create_task(h(context, data))
-                else:
-                    h(context, data)
-        asyncio.get_running_loop().set_exception_handler(error)
-
-        async def sender(ws):
-            while True:
-                data = await self.__queue.get()
-                await ws.send(json.dumps(data))
-                await asyncio.sleep(self.msg_cd)
-
-        async def event(data):
-            match (data["post_type"]):
-                case "message":
-                    msg: Message
-                    if data["message_type"] == "private":
-                        msg = PrivateMessage.from_dict(data)
-                    else:
-                        msg = GroupMessage.from_dict(data)
-                        
-                    if msg.message[0]["type"] == "text":
-                        parts = msg.message[0]["data"]["text"].split(" ")
-                         # 如果用户没有添加指令就不要执行了
-                        if len(self.__commands) > 1 and msg.raw_message[0] in self.cmd_prefix:
-                            # 是指令
-                            for cmd in self.__commands:
-                                if parts[0][1:] in cmd.names and isinstance(msg, cmd.cmd_type):
-                                    if not cmd.is_target(msg):
-                                        continue
-
-                                    self.getLogger().debug(f"执行指令 {msg.raw_message}")
-                                    params = {}
-                                    for k, v in cmd.func.__annotations__.items():
-                                        if issubclass(v, Message):
-                                            params[k] = msg
-
-                                    if inspect.iscoroutinefunction(cmd.func):
-                                        task = asyncio.create_task(cmd.func(**params))
-                                    else:
-                                        task = asyncio.create_task(asyncio.to_thread(cmd.func, **params))
-                                    
-                                    break
-
-                    for handler in self.__message_handlers.get(Message, []) + self.__message_handlers.get(type(msg), []):
-                        if inspect.iscoroutinefunction(handler):
-                            task = asyncio.create_task(handler(msg))
-                        else:
-                            task = asyncio.create_task(asyncio.to_thread(handler, msg))
-                        self.__add_task(task, data)
-                    await self.call_api(
-                        action="mark_msg_as_read", params={"message_id": msg.message_id}
-                    )
-                case "meta_event":
-                    if data["meta_event_type"] == "heartbeat":
-                        if data["status"]["online"] != self.__online:
-                            self.__online = data["status"]["online"]
-                            self.getLogger().info(
-                                f"当前在线状态改变: {"在线" if  self.__online else "离线"}"
-                            )
-                    elif data["sub_type"] == "connect":
-                        id = data["self_id"]
-                        _instances[id] = self
-
-                        def callback(f: asyncio.Future):
-                            nickname = f.result()["data"]["nickname"]
-                            self.me = User(nickname=nickname, user_id=id)
-                            self.getLogger().info(
-                                f"当前机器人账号: {nickname}({id})"
-                            )
-
-                        (await self.__send("get_login_info")).add_done_callback(
-                            callback
-                        )
-                case "message_sent":
-                    pass
-                case "notice":
-                    for clazz in notices:
-                        if clazz.notice_type == data["notice_type"]:
-                            for base in clazz.__bases__ + (clazz,):
-                                for handler in self.__notice_handlers.get(base, []):
-                                    if inspect.iscoroutinefunction(handler):
-                                        task = asyncio.create_task(
-                                            handler(clazz.from_dict(data))
-                                        )
-                                    else:
-                                        task = asyncio.create_task(asyncio.to_thread(handler, clazz.from_dict(data)))
-                                    self.__add_task(task, data)
-                case "request":
-                    for clazz in requests:
-                        if clazz.request_type == data["request_type"]:
-                            for base in clazz.__bases__ + (clazz,):
-                                for handler in self.__request_handlers.get(base, []):
-                                    if inspect.iscoroutinefunction(handler):
-                                        task = asyncio.create_task(
-                                            handler(clazz.from_dict(data))
-                                        )
-                                    else:
-                                        task = asyncio.create_task(asyncio.to_thread(handler, clazz.from_dict(data)))
-                                    self.__add_task(task, data)
-                case _:
-                    self.getLogger().warning("Onebot 上报了未知事件.")
-
-
-        async def receiver(ws):
-            # 不要在 receiver 里面调用 call_api()
-            while True:
-                data: dict = json.loads(await ws.recv())
-                self.getLogger().debug(data)
-                if "echo" in data:
-                    if data["retcode"] == 1403:
-                        self.getLogger().fatal("Access Token 错误")
-                        sys.exit(-1)
-                    future = self.__futures.get(data["echo"])
-                    if future == None:
-                        self.getLogger().warning(
-                            f"Onebot 发送了了无效的 echo: {data["echo"]}"
-                        )
-                        continue
-                    future.set_result(data)
-                    self.__futures.pop(data["echo"])
-                else:
-                    asyncio.create_task(event(data))
-            
+
         async for ws in websockets.connect(uri=self.ws_uri, additional_headers={"Authorization": f"Bearer {self.__token}"}):
             self.getLogger().info(f"连接至 Onebot: {self.ws_uri}")
+            await self._serve(ws)
+            self.getLogger().warning("5s后将尝试重新连接...")
+            await asyncio.sleep(5)
+            self.getLogger().warning("尝试重新连接...")
+
+    async def _serve(self, ws, self_id: int | None = None):
+        """
+        在一个已经建立好的连接上收发数据, 连接断开后返回.
+        ws 只需要实现 send(data, text=True) 和 recv(decode=False), 反向 Websocket 和 HTTP 也走这里.
+        self_id 不为 None 时直接注册账号, 用于不会上报 lifecycle 事件的连接.
+        """
+        self.__setup()
+        try:
+            # 任意一边退出都要把另一边也停掉, 否则旧的 sender 会留下来抢新连接的数据
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(self.__sender(ws))
+                tg.create_task(self.__receiver(ws))
+                if self_id != None:
+                    tg.create_task(self.__on_connect(self_id))
+        except* websockets.ConnectionClosed:
+            self.__fail_pending(ConnectionError("与 Onebot 的连接断开"))
+            self.getLogger().error("与 Onebot 的连接断开")
+        except* AccessTokenError as eg:
+            self.__fail_pending(ConnectionError("Access Token 错误"))
+            raise eg.exceptions[0]
+
+    def __setup(self):
+        if self.__workers != None:
+            return
+
+        _bots.add(self)
+        loop = asyncio.get_running_loop()
+        if loop.get_exception_handler() is not _exception_handler:
+            loop.set_exception_handler(_exception_handler)
+
+        self.__workers = [asyncio.create_task(self.__worker()) for _ in range(self.workers or 0)]
+
+    def _on_error(self, loop: asyncio.AbstractEventLoop, context: dict):
+        self.getLogger().error(context)
+        data = context.get("data")
+        for h in self.__error_handlers:
+            if inspect.iscoroutinefunction(h):
+                loop.create_task(h(context, data))
+            else:
+                h(context, data)
+
+    async def __sender(self, ws):
+        while True:
+            data = await self.__queue.get()
+            await ws.send(self.codec.dumps(data), text=True)
+
+    async def __receiver(self, ws):
+        # 不要在 receiver 里面调用 call_api()
+        while True:
+            raw = await ws.recv(decode=False)
+            if len(raw) > self.offload_size:
+                data: dict = await asyncio.to_thread(self.codec.loads, raw)
+            else:
+                data: dict = self.codec.loads(raw)
+            self.getLogger().debug(data)
+            if "echo" in data:
+                if data["retcode"] == 1403:
+                    self.getLogger().fatal("Access Token 错误")
+                    raise AccessTokenError("Access Token 错误")
+                future = self.__futures.pop(data["echo"], None)
+                if future == None or future.done():
+                    # 调用已经超时或被取消了
+                    self.getLogger().debug(
+                        f"Onebot 发送了无效的 echo: {data["echo"]}"
+                    )
+                    continue
+                future.set_result(data)
+            elif self.events != None:
+                await self.events.put(data)
+            else:
+                # 解码或分发失败时也要交给这个账号的 on_error
+                self.__add_task(asyncio.create_task(self.__event(data)), data)
+
+    async def __worker(self):
+        while True:
+            data = await self.events.get()
             try:
-                await asyncio.gather(sender(ws), receiver(ws))
-            except websockets.ConnectionClosed:
-                self.getLogger().error("与 Onebot 的 Websocket 连接断开")
-                self.getLogger().warning("5s后将尝试重新连接...")
-                await asyncio.sleep(5)
-                self.getLogger().warning("尝试重新连接...")
-
-    async def __send(self, action: str, params: dict | None = None) -> asyncio.Future:
-        echo = uuid.uuid4().hex
-        self.__futures[echo] = asyncio.Future()
-        await self.__queue.put({"action": action, "params": params, "echo": echo})
-        return self.__futures[echo]
+                async with self.__slots:
+                    tasks = [t for t in await self.__event(data) if t != None]
+                    if tasks:
+                        # 等处理函数跑完再取下一个事件, 以此限制并发
+                        await asyncio.wait(tasks)
+            except Exception as e:
+                asyncio.get_running_loop().call_exception_handler(
+                    {"message": "处理事件时发生异常", "exception": e, "data": data, "bot": self}
+                )
 
-    async def call_api(self, action: str, params: dict | None = None) -> dict:
-        return await (await self.__send(action=action, params=params))        
+    async def __event(self, data: dict) -> list[asyncio.Task]:
+        tasks = []
+        match (data["post_type"]):
+            case "message":
+                msg: Message
+                if data["message_type"] == "private":
+                    msg = decode(PrivateMessage, data)
+                else:
+                    msg = decode(GroupMessage, data)
+                self.messages.put(msg)
+
+                text = _leading_text(msg.message)
+                if len(self.__commands) > 1 and text != None:
+                    # 如果用户没有添加指令就不要执行了
+                    cmd = self.__match_cmd(msg, text)
+                    if cmd != None:
+                        self.getLogger().debug(f"执行指令 {msg.raw_message}")
+                        tasks.append(self.__spawn(cmd.handler, msg, data))
+
+                for handler in self.__message_handlers.get(Message, []) + self.__message_handlers.get(type(msg), []):
+                    tasks.append(self.__spawn(handler, msg, data))
+                self.__receipts.add(_chat_key(msg), msg.message_id)
+            case "meta_event":
+                if data["meta_event_type"] == "heartbeat":
+                    if data["status"]["online"] != self.__online:
+                        self.__online = data["status"]["online"]
+                        self.getLogger().info(
+                            f"当前在线状态改变: {"在线" if  self.__online else "离线"}"
+                        )
+                elif data["sub_type"] == "connect":
+                    await self.__on_connect(data["self_id"])
+            case "message_sent":
+                # 自己发出的消息, 包括其他客户端发的
+                self.messages.put(
+                    decode(PrivateMessage if data["message_type"] == "private" else GroupMessage, data)
+                )
+            case "notice":
+                tasks += self.__route(self.__notice_routes, data["notice_type"], data)
+            case "request":
+                tasks += self.__route(self.__request_routes, data["request_type"], data)
+            case _:
+                self.getLogger().warning("Onebot 上报了未知事件.")
+        return tasks
+
+    async def __on_connect(self, id: int):
+        _instances[id] = self
+
+        def callback(f: asyncio.Future):
+            if f.cancelled() or f.exception() != None:
+                self.getLogger().error(f"获取登录信息失败: {None if f.cancelled() else f.exception()}")
+                return
+            nickname = f.result()["data"]["nickname"]
+            self.me = User(nickname=nickname, user_id=id)
+            self.getLogger().info(
+                f"当前机器人账号: {nickname}({id})"
+            )
+
+        (await self.__send("get_login_info")).add_done_callback(
+            callback
+        )
+
+    async def __send(
+        self, action: str, params: dict | None = None, timeout: float | None = None
+    ) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        timeout = timeout or self.api_timeout
+        # 在限速队列里等待的时间也算在超时里
+        deadline = loop.time() + timeout if timeout else None
+        self.__throttled += 1
+        try:
+            async with asyncio.timeout_at(deadline):
+                await self.scheduler.acquire(action, params)
+        except TimeoutError:
+            raise TimeoutError(f"调用 {action} 超时 ({timeout}s)") from None
+        finally:
+            self.__throttled -= 1
+        echo = str(next(self.__echo))
+        future = loop.create_future()
+        self.__futures[echo] = future
+
+        if deadline != None:
+            def expire():
+                if not future.done():
+                    future.set_exception(TimeoutError(f"调用 {action} 超时 ({timeout}s)"))
+            handle = loop.call_at(deadline, expire)
+            future.add_done_callback(lambda _: handle.cancel())
+        # 超时, 取消或者收到响应后都不再占用 __futures
+        future.add_done_callback(lambda _: self.__futures.pop(echo, None))
+
+        await self.__queue.put({"action": action, "params": params, "echo": echo})
+        return future
+
+    async def call_api(
+        self, action: str, params: dict | None = None, timeout: float | None = None
+    ) -> dict:
+        """ timeout 为 None 时使用 api_timeout, 超时抛出 TimeoutError, 连接断开抛出 ConnectionError """
+        return await (await self.__send(action=action, params=params, timeout=timeout))
+
+    @property
+    def pending_calls(self) -> int:
+        """ 还在限速队列里排队或者等待响应的调用数 """
+        return self.__throttled + len(self.__futures)
+
+    def _fail_call(self, echo: str, e: Exception):
+        """ 让一个还在等待响应的调用失败, ShardedBot 的子进程使用 """
+        future = self.__futures.pop(echo, None)
+        if future != None and not future.done():
+            future.set_exception(e)
+
+    def __fail_pending(self, e: Exception):
+        for future in list(self.__futures.values()):
+            if not future.done():
+                future.set_exception(e)
+        self.__futures.clear()
+        # 还没发出去的帧对应的调用已经失败了, 不要在重连后再发
+        while not self.__queue.empty():
+            self.__queue.get_nowait()
+
+    async def __mark_read(self, id: int):
+        try:
+            await self.call_api("mark_msg_as_read", {"message_id": id})
+        except (TimeoutError, ConnectionError) as e:
+            self.getLogger().debug(f"标记已读失败: {e}")
 
     def on_cmd(
         self,
         name: str | list[str],
         admin: bool = False,
         help_msg: str = "开发者很懒, 没有添加描述哦~",
-        targets: list[str | int] = []
+        targets: list[str | int] = [],
+        executor: HandlerExecutor | None = None,
+        serial: bool | Callable[[Message], Hashable] = False,
     ):
+        """
+        serial 为 True 时同一个群 / 私聊里的指令依次执行, 不同的群之间仍然并发.
+        也可以传入一个函数, 返回值相同的消息依次执行. 所有 serial 处理函数共用一个队列
+        """
         if not help_msg:
             raise ValueError("帮助文本不能为 None")
         if not name:
@@ -254,40 +474,80 @@ class Bot:
             else:
                 if not all(map(lambda t: isinstance(t, int), targets)):
                     raise ValueError("接收 PrivateMessage / GroupMessage 的处理函数的 targets 必须是 int 类型")
-                    
-            if any(map(lambda n: n in self.__cmd_names, name)):
-                raise ValueError("指令名重复")
-            self.__cmd_names.append(name)
-            self.__commands.append(
-                Command(
-                    names=name,
-                    func=func,
-                    cmd_type=msg_type,
-                    admin=admin,
-                    help_msg=help_msg,
-                    targets=targets
-                )
+
+            cmd = Command(
+                names=name,
+                func=func,
+                cmd_type=msg_type,
+                admin=admin,
+                help_msg=help_msg,
+                targets=targets,
+                handler=Handler.of(func, executor or self.executor, _serial_key(serial)),
             )
+            types = [t for t in (PrivateMessage, GroupMessage) if issubclass(t, msg_type)]
+            for t in types:
+                for n in name:
+                    if any(c.overlaps(cmd, t) for c in self.__cmd_index.get(n, {}).get(t, [])):
+                        raise ValueError("指令名重复")
+            self.__commands.append(cmd)
+            for t in types:
+                for n in name:
+                    self.__cmd_index.setdefault(n, {}).setdefault(t, []).append(cmd)
+            self.__cmd_targets[PrivateMessage].update(cmd.users)
+            self.__cmd_targets[GroupMessage].update(cmd.groups)
+            self.__help_cache.clear()
             self.getLogger().debug(
                 f'加载指令: {name} "{func.__code__.co_filename}", line {func.__code__.co_firstlineno + 1}'
             )
 
         return f
 
-    def on_notice(self):
+    def __match_cmd(self, msg: Message, text: str) -> Command | None:
+        for prefix in self.__cmd_prefixes:
+            if text.startswith(prefix):
+                name = text[len(prefix):].split(" ", 1)[0]
+                break
+        else:
+            return None
+        for cmd in self.__cmd_index.get(name, {}).get(type(msg), []):
+            if cmd.is_target(msg):
+                return cmd
+        return None
+
+    def __get_help(self, msg: Message) -> str:
+        # 没有被任何指令指定的目标看到的帮助都一样, 共用一份缓存
+        id = msg.group_id if isinstance(msg, GroupMessage) else msg.sender.user_id
+        key = (type(msg), id if id in self.__cmd_targets[type(msg)] else None)
+        text = self.__help_cache.get(key)
+        if text == None:
+            cmds = [cmd for cmd in self.__commands if isinstance(msg, cmd.cmd_type) and cmd.is_target(msg)]
+            if len(cmds) == 1:
+                text = "啥指令都没有呢~"
+            else:
+                prefix = self.cmd_prefix[0]
+                text = f"✨指令列表\n\n" + "\n".join(
+                    f"{prefix}{f", {prefix}".join(cmd.names)}: {cmd.help_msg}" for cmd in cmds
+                )
+            self.__help_cache[key] = text
+        return text
+
+    def on_notice(self, executor: HandlerExecutor | None = None):
         def f(func: Callable):
             if len(func.__annotations__) != 1:
                 raise ValueError("处理函数必须只有1个参数")
             notice_type = list(func.__annotations__.values())[0]
             if not issubclass(notice_type, Notice):
                 raise ValueError(f"参数必须是 Notice 的子类, 实际是{notice_type}")
-            handlers = self.__notice_handlers.get(notice_type, [])
-            handlers.append(func)
-            self.__notice_handlers[notice_type] = handlers
+            self.__add_route(self.__notice_routes, notices, notice_type, Handler.of(func, executor or self.executor))
 
         return f
 
-    def on_msg(self):
+    def on_msg(
+        self,
+        executor: HandlerExecutor | None = None,
+        serial: bool | Callable[[Message], Hashable] = False,
+    ):
+        """ serial 同 on_cmd """
         def f(func: Callable):
             if len(func.__annotations__) != 1:
                 raise ValueError("处理函数必须只有1个参数")
@@ -295,21 +555,19 @@ class Bot:
             if not issubclass(msg_type, Message):
                 raise ValueError(f"参数必须是 Message 的子类, 实际是{msg_type}")
             handlers = self.__message_handlers.get(msg_type, [])
-            handlers.append(func)
+            handlers.append(Handler.of(func, executor or self.executor, _serial_key(serial)))
             self.__message_handlers[msg_type] = handlers
 
         return f
     
-    def on_request(self):
+    def on_request(self, executor: HandlerExecutor | None = None):
         def f(func: Callable):
             if len(func.__annotations__) != 1:
                 raise ValueError("处理函数必须只有1个参数")
             request_type = list(func.__annotations__.values())[0]
             if not issubclass(request_type, Request):
                 raise ValueError(f"参数必须是 Request 的子类, 实际是{request_type}")
-            handlers = self.__request_handlers.get(request_type, [])
-            handlers.append(func)
-            self.__request_handlers[request_type] = handlers
+            self.__add_route(self.__request_routes, requests, request_type, Handler.of(func, executor or self.executor))
             
         return f
 
@@ -322,62 +580,189 @@ class Bot:
         return f
 
     async def send_private(
-        self, user: User | int, msg: str | dict, auto_escape: bool = False
+        self, user: User | int, msg: str | dict | MessageSegment | MessageChain, auto_escape: bool = False
     ) -> int | None:
+        """ msg 为消息链时以数组格式发送, Onebot 不需要再解析 CQ 码 """
         resp = await self.call_api(
             "send_private_msg",
             {
                 "user_id": user.user_id if isinstance(user, User) else user,
-                "message": msg,
+                "message": _serialize(msg),
                 "auto_escape": auto_escape,
             },
         )
-        return resp["data"]["message_id"] if resp["status"] == "ok" else None
+        if resp["status"] != "ok":
+            return None
+        self.__remember(PrivateMessage, resp["data"]["message_id"], msg, auto_escape)
+        return resp["data"]["message_id"]
 
     async def send_group(
-        self, group: int, msg: str | dict, auto_escape: bool = False
+        self, group: int, msg: str | dict | MessageSegment | MessageChain, auto_escape: bool = False
     ) -> int | None:
         resp = await self.call_api(
             "send_group_msg",
             {
                 "group_id": group,
-                "message": msg,
+                "message": _serialize(msg),
                 "auto_escape": auto_escape,
             },
         )
-
-        return resp["data"]["message_id"] if resp["status"] == "ok" else None
+        if resp["status"] != "ok":
+            return None
+        self.__remember(GroupMessage, resp["data"]["message_id"], msg, auto_escape, group_id=group)
+        return resp["data"]["message_id"]
+
+    def __remember(self, cls: Type[Message], id: int, msg, auto_escape: bool, **kwargs):
+        # 把自己发的消息放进缓存, 回复链里经常会查到
+        if self.me == None or self.messages.max_items <= 0:
+            return
+        if isinstance(msg, (MessageChain, MessageSegment)):
+            chain = MessageChain.of(msg)
+        elif isinstance(msg, str) and auto_escape:
+            chain = MessageChain.of(msg)
+        else:
+            chain = MessageChain.parse(msg)
+        self.messages.put(
+            cls(
+                self_id=self.me.user_id,
+                time=int(time.time()),
+                message_id=id,
+                sender=self.me,
+                message=chain.to_array(),
+                raw_message=chain.to_cq(),
+                **kwargs,
+            )
+        )
 
     async def get_msg(self, id: int) -> Message:
+        """ 先查最近收发的消息, 查不到再调用 API, 命中率见 bot.messages.stats() """
+        msg = self.messages.get(id)
+        if msg != None:
+            return msg
         resp = await self.call_api("get_msg", {"message_id": id})
         if resp["data"]["message_type"] == "private":
-            return PrivateMessage.from_dict(resp["data"])
+            msg = decode(PrivateMessage, resp["data"])
         else:
-            return GroupMessage.from_dict(resp["data"])
+            msg = decode(GroupMessage, resp["data"])
+        self.messages.put(msg)
+        return msg
+
+    async def get_group_info(self, group_id: int, no_cache: bool = False) -> GroupInfo | None:
+        """ 查询失败时返回 None, 下同 """
+        return await self.info.get(
+            ("group", group_id),
+            lambda: self.__get_info(GroupInfo, "get_group_info", {"group_id": group_id, "no_cache": no_cache}),
+            refresh=no_cache,
+        )
+
+    async def get_stranger_info(self, user_id: int, no_cache: bool = False) -> Stranger | None:
+        return await self.info.get(
+            ("user", user_id),
+            lambda: self.__get_info(Stranger, "get_stranger_info", {"user_id": user_id, "no_cache": no_cache}),
+            refresh=no_cache,
+        )
+
+    async def get_group_member_info(self, group_id: int, user_id: int, no_cache: bool = False) -> Member | None:
+        return await self.info.get(
+            ("member", group_id, user_id),
+            lambda: self.__get_info(
+                Member, "get_group_member_info", {"group_id": group_id, "user_id": user_id, "no_cache": no_cache}
+            ),
+            refresh=no_cache,
+        )
+
+    async def __get_info(self, cls: type, action: str, params: dict):
+        resp = await self.call_api(action, params)
+        if resp["status"] != "ok" or not resp["data"]:
+            return None
+        return decode(cls, resp["data"])
 
     def getLogger(self) -> logging.Logger:
         return botx.logging.getLogger(name="Core" if self.me == None else self.me.user_id, level=self.log_level)
 
     async def get_qzone(self) -> Qzone:
-        cookies = dict(
-                c.split("=")
-                for c in 
-                (await self.call_api("get_cookies", {"domain": "user.qzone.qq.com"}))["data"]["cookies"]
-                .replace(" ", "")
-                .split(";")
-            )
-        return Qzone(uin=str(self.me.user_id), cookies=cookies)
+        """ 每个账号只创建一次, cookies 失效时会自动重新获取 """
+        async with self.__session_lock:
+            if self.__qzone == None:
+                refresh = lambda: self.__get_cookies("user.qzone.qq.com")
+                self.__qzone = Qzone(
+                    uin=str(self.me.user_id), cookies=await refresh(), transport=self.__transport(), refresh=refresh
+                )
+            return self.__qzone
 
     async def get_guild(self) -> Guild:
-        cookies = dict(
-                c.split("=")
-                for c in 
-                (await self.call_api("get_cookies", {"domain": "pd.qq.com"}))["data"]["cookies"]
-                .replace(" ", "")
-                .split(";")
-            )
-        return Guild(uin=str(self.me.user_id), cookies=cookies)
+        """ 同 get_qzone """
+        async with self.__session_lock:
+            if self.__guild == None:
+                refresh = lambda: self.__get_cookies("pd.qq.com")
+                self.__guild = Guild(
+                    uin=str(self.me.user_id), cookies=await refresh(), transport=self.__transport(), refresh=refresh
+                )
+            return self.__guild
+
+    async def __get_cookies(self, domain: str) -> dict:
+        cookies = (await self.call_api("get_cookies", {"domain": domain}))["data"]["cookies"]
+        # cookie 的值里可能有 "="
+        return dict(c.strip().partition("=")[::2] for c in cookies.split(";") if c.strip())
+
+    def __transport(self) -> httpx.AsyncBaseTransport:
+        if self.http_transport == None:
+            self.http_transport = make_transport()
+        return self.http_transport
         
-    def __add_task(self, task: asyncio.Task, data: dict):
+    def __add_route(self, routes: dict, classes: list[type], base: type, handler: Handler):
+        # 注册时就展开到所有能收到该事件的具体类上, 分发时只需查表
+        # 具体类会在自己的类体里声明 notice_type / request_type, 可选声明 *_sub_type
+        attr = "notice_type" if issubclass(base, Notice) else "request_type"
+        for clazz in classes:
+            if clazz in (Notice, Request) or attr not in clazz.__dict__ or not issubclass(clazz, base):
+                continue
+            key = (clazz.__dict__[attr], clazz.__dict__.get(attr.replace("_type", "_sub_type")))
+            routes.setdefault(key, {}).setdefault(clazz, []).append(handler)
+
+    def __route(self, routes: dict, kind: str, data: dict) -> list[asyncio.Task]:
+        tasks = []
+        sub_type = data.get("sub_type")
+        for key in ((kind, sub_type), (kind, None)) if sub_type != None else ((kind, None),):
+            for clazz, handlers in routes.get(key, {}).items():
+                # 每个事件只解码一次
+                event = decode(clazz, data)
+                for handler in handlers:
+                    tasks.append(self.__spawn(handler, event, data))
+        return tasks
+
+    def __spawn(self, handler: Handler, arg, data: dict) -> asyncio.Task | None:
+        """ 返回 None 表示调用还在 SerialExecutor 里排队, worker 不需要等它 """
+        if handler.serial == None:
+            return self.__add_task(asyncio.create_task(handler(arg)), data)
+        key = handler.serial(arg)
+        # 在这里同步占用 key, 才能知道这个调用会不会排队
+        turn = self.serial.enter(key)
+        task = self.__add_task(asyncio.create_task(self.__run_serial(key, turn, handler, arg)), data)
+        return task if turn == None else None
+
+    async def __run_serial(self, key: Hashable, turn: asyncio.Future | None, handler: Handler, arg):
+        if turn != None:
+            await self.serial.wait(key, turn)
+        try:
+            if turn != None and self.__slots != None:
+                # 排队时没有占用 worker, 轮到自己后再占一个位置, 总并发仍然不超过 workers
+                async with self.__slots:
+                    return await handler(arg)
+            return await handler(arg)
+        finally:
+            self.serial.leave(key)
+
+    def __add_task(self, task: asyncio.Task, data: dict) -> asyncio.Task:
         self.__tasks[task.get_name()] = data
-        task.add_done_callback(lambda t: self.__tasks.pop(t.get_name()))
+
+        def done(t: asyncio.Task):
+            data = self.__tasks.pop(t.get_name())
+            # 在这里取出异常, 才能把 Onebot 发送的数据交给 on_error
+            if not t.cancelled() and t.exception() != None:
+                t.get_loop().call_exception_handler(
+                    {"message": "处理函数发生异常", "exception": t.exception(), "future": t, "data": data, "bot": self}
+                )
+
+        task.add_done_callback(done)
+        return task
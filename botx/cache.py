@@ -0,0 +1,183 @@
+import asyncio
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+from botx.models import Message
+
+
+def _estimate(msg: Message) -> int:
+    # 不需要精确, 只要和消息长度成正比. message 和 raw_message 各存了一份内容
+    return 512 + 2 * sys.getsizeof(msg.raw_message)
+
+
+class MessageCache:
+    """ 最近收发的消息, 按条数和估算的字节数做 LRU 淘汰 """
+
+    max_items: int
+    max_bytes: int
+    bytes: int
+    hits: int
+    misses: int
+    __items: OrderedDict[int, tuple[Message, int]]
+
+    def __init__(self, max_items: int = 10000, max_bytes: int = 64 << 20):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.__items = OrderedDict()
+
+    def __len__(self):
+        return len(self.__items)
+
+    def __contains__(self, id: int):
+        return id in self.__items
+
+    def get(self, id: int) -> Message | None:
+        item = self.__items.get(id)
+        if item == None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.__items.move_to_end(id)
+        return item[0]
+
+    def put(self, msg: Message):
+        if self.max_items <= 0:
+            return
+        self.discard(msg.message_id)
+        size = _estimate(msg)
+        self.__items[msg.message_id] = (msg, size)
+        self.bytes += size
+        while len(self.__items) > self.max_items or (self.bytes > self.max_bytes and len(self.__items) > 1):
+            _, (_, size) = self.__items.popitem(last=False)
+            self.bytes -= size
+
+    def discard(self, id: int):
+        item = self.__items.pop(id, None)
+        if item != None:
+            self.bytes -= item[1]
+
+    def clear(self):
+        self.__items.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "items": len(self.__items),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0,
+        }
+
+
+class TTLCache:
+    """
+    带过期时间的缓存, 按条数做 LRU 淘汰.
+    同一个 key 同时只会加载一次, 其他调用等待同一个结果, 负责加载的调用被取消时由等待的调用重新加载.
+    加载结果为 None 时不缓存.
+    """
+
+    ttl: float
+    max_items: int
+    hits: int
+    misses: int
+    coalesced: int
+    """ 等待其他调用加载结果的次数 """
+    __items: OrderedDict[Hashable, tuple[float, Any]]
+    __loading: dict[Hashable, asyncio.Future]
+
+    def __init__(self, ttl: float = 300, max_items: int = 10000):
+        self.ttl = ttl
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.__items = OrderedDict()
+        self.__loading = {}
+
+    def __len__(self):
+        return len(self.__items)
+
+    async def get(self, key: Hashable, load: Callable[[], Awaitable[Any]], refresh: bool = False) -> Any:
+        """ refresh 为 True 时忽略已缓存的值 """
+        while not refresh:
+            item = self.__items.get(key)
+            if item != None and item[0] > time.monotonic():
+                self.hits += 1
+                self.__items.move_to_end(key)
+                return item[1]
+            loading = self.__loading.get(key)
+            if loading == None:
+                break
+            self.coalesced += 1
+            try:
+                # 等待的一方被取消时不能影响负责加载的一方
+                return await asyncio.shield(loading)
+            except asyncio.CancelledError:
+                # 负责加载的一方被取消了, 自己没有被取消的话重新加载
+                if not loading.cancelled() or asyncio.current_task().cancelling():
+                    raise
+        self.misses += 1
+
+        future = asyncio.get_running_loop().create_future()
+        self.__loading[key] = future
+        try:
+            value = await load()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他调用在等待时也不要报 "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            if self.__loading.get(key) is future:
+                del self.__loading[key]
+                stale = False
+            else:
+                # 加载期间被 invalidate 了, 结果照常返回但不缓存
+                stale = True
+        future.set_result(value)
+        if value != None and not stale:
+            self.put(key, value)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_items <= 0:
+            return
+        self.__items[key] = (time.monotonic() + self.ttl, value)
+        self.__items.move_to_end(key)
+        while len(self.__items) > self.max_items:
+            self.__items.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self.__items.pop(key, None)
+        self.__loading.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]):
+        for key in [k for k in self.__items if predicate(k)]:
+            del self.__items[key]
+        for key in [k for k in self.__loading if predicate(k)]:
+            del self.__loading[key]
+
+    def clear(self):
+        self.__items.clear()
+        self.__loading.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses + self.coalesced
+        return {
+            "items": len(self.__items),
+            "loading": len(self.__loading),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / total if total else 0,
+        }
@@ -0,0 +1,59 @@
+import json
+from typing import Any
+
+
+class Codec:
+    """ 标准库 json, 默认使用 """
+
+    name = "json"
+
+    def loads(self, data: str | bytes) -> Any:
+        return json.loads(data)
+
+    def dumps(self, obj: Any) -> str | bytes:
+        return json.dumps(obj)
+
+
+class OrjsonCodec(Codec):
+    """ 需要安装 orjson """
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self.loads = orjson.loads
+        self.dumps = orjson.dumps
+
+
+class MsgspecCodec(Codec):
+    """ 需要安装 msgspec """
+
+    name = "msgspec"
+
+    def __init__(self):
+        import msgspec
+
+        self.loads = msgspec.json.Decoder().decode
+        self.dumps = msgspec.json.Encoder().encode
+
+
+_codecs: dict[str, type[Codec]] = {
+    "json": Codec,
+    "orjson": OrjsonCodec,
+    "msgspec": MsgspecCodec,
+}
+
+
+def get_codec(name: str = "auto") -> Codec:
+    """ name 为 auto 时按 orjson, msgspec, json 的顺序选择已安装的实现 """
+    if name == "auto":
+        for clazz in (OrjsonCodec, MsgspecCodec):
+            try:
+                return clazz()
+            except ImportError:
+                continue
+        return Codec()
+    if name not in _codecs:
+        raise ValueError(f"未知的 codec: {name}")
+    return _codecs[name]()
@@ -0,0 +1,198 @@
+import asyncio
+from collections import Counter, deque
+
+POLICIES = ("block", "drop_oldest", "shed_group")
+
+
+def is_low_priority(data: dict) -> bool:
+    """ 心跳, 表情回应和自己发出的消息可以在忙的时候丢掉 """
+    match data.get("post_type"):
+        case "meta_event":
+            return data.get("meta_event_type") == "heartbeat"
+        case "notice":
+            return data.get("notice_type") == "group_msg_emoji_like"
+        case "message_sent":
+            return True
+    return False
+
+
+def _droppable(data: dict) -> bool:
+    # lifecycle 事件负责注册 Bot 实例, 永远不丢
+    return not (
+        data.get("post_type") == "meta_event"
+        and data.get("meta_event_type") == "lifecycle"
+    )
+
+
+class EventQueue:
+    """
+    有界的事件队列, 满了之后按 policy 处理:
+    block: 暂停读取 Websocket, 直到有空位
+    drop_oldest: 丢掉最早的低优先级事件, 没有的话丢掉最早的事件
+    shed_group: 丢掉排队最多的群的事件, 保证其他群不受刷屏影响
+    """
+
+    maxsize: int
+    policy: str
+    peak: int
+    dropped: Counter
+    __items: deque[list]
+    """ 排队的事件, 每个包在 [data] 里; 中间被丢掉的变成 [None] 留在原处, get 时跳过 """
+    __low: deque[list]
+    """ 可以丢的低优先级事件, 和 __items 共用同一个 [data] """
+    __droppable: deque[list]
+    """ 除了 lifecycle 以外的所有事件 """
+    __groups: dict[int, deque[list]]
+    __counts: dict[int, int]
+    """ 每个群还在排队的事件数 """
+    __buckets: dict[int, dict[int, None]]
+    """ 排队事件数 -> 这么多事件的群, 按变成这个数的先后排列 """
+    __largest: int
+    __size: int
+    __not_empty: asyncio.Condition
+    __not_full: asyncio.Condition
+
+    def __init__(self, maxsize: int = 10000, policy: str = "drop_oldest"):
+        if policy not in POLICIES:
+            raise ValueError(f"policy 必须是 {", ".join(POLICIES)} 之一")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.peak = 0
+        self.dropped = Counter()
+        self.__items = deque()
+        self.__low = deque()
+        self.__droppable = deque()
+        self.__groups = {}
+        self.__counts = {}
+        self.__buckets = {}
+        self.__largest = 0
+        self.__size = 0
+        lock = asyncio.Lock()
+        self.__not_empty = asyncio.Condition(lock)
+        self.__not_full = asyncio.Condition(lock)
+
+    def __len__(self):
+        return self.__size
+
+    async def put(self, data: dict):
+        async with self.__not_full:
+            if self.__size >= self.maxsize:
+                if self.policy == "block":
+                    await self.__not_full.wait_for(
+                        lambda: self.__size < self.maxsize
+                    )
+                elif not self.__shed(data):
+                    return
+            cell = [data]
+            self.__items.append(cell)
+            self.__size += 1
+            if _droppable(data):
+                self.__droppable.append(cell)
+                if is_low_priority(data):
+                    self.__low.append(cell)
+                group = data.get("group_id")
+                if group != None:
+                    self.__groups.setdefault(group, deque()).append(cell)
+                    self.__recount(group, 1)
+            self.peak = max(self.peak, self.__size)
+            self.__not_empty.notify()
+
+    async def get(self) -> dict:
+        async with self.__not_empty:
+            await self.__not_empty.wait_for(lambda: self.__size)
+            cell = self.__items.popleft()
+            while cell[0] == None:
+                cell = self.__items.popleft()
+            data, cell[0] = cell[0], None
+            self.__forget(data)
+            self.__not_full.notify()
+            return data
+
+    def __forget(self, data: dict):
+        """ data 已经离开队列 (被取走或丢掉), 它的 [data] 已经置为 [None] """
+        self.__size -= 1
+        if not _droppable(data):
+            return
+        # 取走的总是最早的事件, 各个索引里它前面的都已经失效了, 从左边清掉
+        _trim(self.__droppable)
+        if is_low_priority(data):
+            _trim(self.__low)
+        group = data.get("group_id")
+        if group != None:
+            if self.__recount(group, -1) == 0:
+                del self.__groups[group]
+            else:
+                _trim(self.__groups[group])
+
+    def __recount(self, group: int, delta: int) -> int:
+        """ 每次只加减 1, 最大的群总能在 O(1) 内找到 """
+        count = self.__counts.pop(group, 0)
+        if count:
+            bucket = self.__buckets[count]
+            del bucket[group]
+            if not bucket:
+                del self.__buckets[count]
+        count += delta
+        if count:
+            self.__counts[group] = count
+            self.__buckets.setdefault(count, {})[group] = None
+            self.__largest = max(self.__largest, count)
+        if self.__largest > 0 and self.__largest not in self.__buckets:
+            self.__largest -= 1
+        return count
+
+    def __shed(self, data: dict) -> bool:
+        """ 腾出一个位置, 返回 False 表示应该丢掉新来的 data """
+        if self.policy == "shed_group" and self.__largest > 1:
+            group = next(iter(self.__buckets[self.__largest]))
+            self.dropped["group"] += 1
+            if data.get("group_id") == group:
+                return False
+            self.__drop(self.__groups[group])
+            return True
+
+        if self.__drop(self.__low):
+            self.dropped["low_priority"] += 1
+            return True
+        if is_low_priority(data):
+            self.dropped["low_priority"] += 1
+            return False
+        if self.__drop(self.__droppable):
+            self.dropped["oldest"] += 1
+        return True
+
+    def __drop(self, index: deque[list]) -> bool:
+        """ 丢掉 index 里最早的事件, 只留下 [None], 不在 __items 中间删除 """
+        _trim(index)
+        if not index:
+            return False
+        cell = index.popleft()
+        data, cell[0] = cell[0], None
+        self.__forget(data)
+        # 失效的位置比事件还多时整体压缩一次, 均摊下来还是 O(1)
+        if len(self.__items) > 2 * self.__size + 64:
+            self.__compact()
+        return True
+
+    def __compact(self):
+        self.__items = _alive(self.__items)
+        self.__low = _alive(self.__low)
+        self.__droppable = _alive(self.__droppable)
+        self.__groups = {g: _alive(q) for g, q in self.__groups.items()}
+
+    def stats(self) -> dict:
+        return {
+            "length": self.__size,
+            "maxsize": self.maxsize,
+            "peak": self.peak,
+            "dropped": dict(self.dropped),
+        }
+
+
+def _trim(index: deque[list]):
+    while index and index[0][0] == None:
+        index.popleft()
+
+
+def _alive(index: deque[list]) -> deque[list]:
+    return deque(cell for cell in index if cell[0] != None)
@@ -0,0 +1,158 @@
+import asyncio
+import contextvars
+import inspect
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class HandlerExecutor:
+    """ 运行同步处理函数的专用线程池, 不占用事件循环的默认线程池 """
+
+    name: str
+    workers: int
+    pending: int
+    """ 已提交但还没结束的调用数 """
+    peak: int
+    saturated: int
+    """ 提交时所有线程都在忙, 只能排队的次数 """
+    __pool: ThreadPoolExecutor
+
+    def __init__(self, workers: int | None = None, name: str = "botx-handler"):
+        self.__pool = ThreadPoolExecutor(workers, thread_name_prefix=name)
+        self.name = name
+        self.workers = self.__pool._max_workers
+        self.pending = 0
+        self.peak = 0
+        self.saturated = 0
+
+    async def run(self, func: Callable, *args) -> Any:
+        if self.pending >= self.workers:
+            self.saturated += 1
+        self.pending += 1
+        self.peak = max(self.peak, self.pending)
+        try:
+            # 和 asyncio.to_thread 一样带上 contextvars
+            ctx = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(
+                self.__pool, ctx.run, func, *args
+            )
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": min(self.pending, self.workers),
+            "queued": max(0, self.pending - self.workers),
+            "peak": self.peak,
+            "saturated": self.saturated,
+        }
+
+    def shutdown(self, wait: bool = True):
+        self.__pool.shutdown(wait=wait)
+
+
+class SerialExecutor:
+    """
+    同一个 key 的调用依次执行, 不同 key 之间互不影响.
+    key 没有调用在排队时立即删除, 占用的内存只和正在活跃的 key 数有关.
+    """
+
+    maxsize: int
+    """ 每个 key 最多排队的调用数, 超出时取消最早排队的调用, 为 0 时不限制 """
+    dropped: int
+    peak: int
+    """ 同时活跃的 key 数的最大值 """
+    __queues: dict[Hashable, deque[asyncio.Future]]
+
+    def __init__(self, maxsize: int = 100):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self.peak = 0
+        self.__queues = {}
+
+    def enter(self, key: Hashable) -> asyncio.Future | None:
+        """ 立即占用 key, 前面有调用时返回轮到自己时完成的 future, 需要 wait 后再执行 """
+        # key 在 __queues 里就说明有调用正在执行, 队列里只放排队的调用
+        queue = self.__queues.get(key)
+        if queue == None:
+            self.__queues[key] = deque()
+            self.peak = max(self.peak, len(self.__queues))
+            return None
+        if self.maxsize and len(queue) >= self.maxsize:
+            queue.popleft().cancel()
+            self.dropped += 1
+        turn = asyncio.get_running_loop().create_future()
+        queue.append(turn)
+        return turn
+
+    async def wait(self, key: Hashable, turn: asyncio.Future):
+        try:
+            await turn
+        except asyncio.CancelledError:
+            # 轮到自己的同时被取消了, 要把机会让给下一个
+            if turn.done() and not turn.cancelled():
+                self.leave(key)
+            raise
+
+    def leave(self, key: Hashable):
+        """ 执行结束, 让下一个排队的调用开始 """
+        queue = self.__queues[key]
+        while queue:
+            turn = queue.popleft()
+            if not turn.done():
+                turn.set_result(None)
+                return
+        del self.__queues[key]
+
+    async def run(self, key: Hashable, func: Callable[..., Awaitable], *args) -> Any:
+        turn = self.enter(key)
+        if turn != None:
+            await self.wait(key, turn)
+        try:
+            return await func(*args)
+        finally:
+            self.leave(key)
+
+    def __len__(self):
+        return len(self.__queues)
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self.__queues),
+            "waiting": sum(len(q) for q in self.__queues.values()),
+            "peak": self.peak,
+            "dropped": self.dropped,
+        }
+
+
+@dataclass(frozen=True, slots=True)
+class Handler:
+    """ 注册时就确定处理函数是协程还是同步函数 """
+
+    func: Callable
+    is_async: bool
+    executor: HandlerExecutor
+    serial: Callable[[Any], Hashable] | None = None
+    """ 不为 None 时, 返回值相同的事件交给 SerialExecutor 依次处理 """
+
+    @classmethod
+    def of(
+        cls,
+        func: Callable,
+        executor: HandlerExecutor,
+        serial: Callable[[Any], Hashable] | None = None,
+    ) -> "Handler":
+        return cls(
+            func=func,
+            is_async=inspect.iscoroutinefunction(func),
+            executor=executor,
+            serial=serial,
+        )
+
+    def __call__(self, *args) -> Awaitable:
+        if self.is_async:
+            return self.func(*args)
+        return self.executor.run(self.func, *args)
@@ -1,19 +1,25 @@
+import asyncio
 import base64
 from email import header
 import hashlib
 import json
+import mmap
 import os
 import time
+from typing import AsyncIterator, Awaitable, Callable, Iterable
 from wsgiref import headers
 
-from httpx import AsyncClient
+from httpx import AsyncBaseTransport
 
+from botx.http import Session, iter_pages, run_window
 from botx.models.user import User
 
 
 UA = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
 
 CHUNK_SIZE = 1 << 20
+# delete_feeds 每个请求最多删除的帖子数
+DELETE_BATCH = 50
 
 
 class Feed:
@@ -33,24 +39,28 @@ class Feed:
         self.images = images
 
 
-class Guild:
-    uin: str
-    cookies: dict
-    client: AsyncClient
+class Guild(Session):
+    token_param = "bkn"
 
-    def __init__(self, uin: str, cookies: dict):
-        self.uin = uin
-        self.cookies = cookies
-        self.client = AsyncClient(
+    def __init__(
+        self,
+        uin: str,
+        cookies: dict,
+        transport: AsyncBaseTransport | None = None,
+        refresh: Callable[[], Awaitable[dict]] | None = None,
+    ):
+        super().__init__(
+            uin,
+            cookies,
+            transport=transport,
+            refresh=refresh,
             base_url="https://pd.qq.com",
-            cookies=cookies,
             headers={
                 "Referer": "https://pd.qq.com/",
                 "Origin": "https://pd.qq.com",
                 "User-Agent": UA,
                 "x-qq-client-appid": "537246381",
             },
-            timeout=60,
         )
 
     async def _apply_upload(self, sha1: str, size: int):
@@ -69,14 +79,12 @@ class Guild:
         )
         return resp.json()["ukey"]
 
-    async def _upload_slice(self, ukey: str, index: int, file_path: str) -> str | None:
-        file_size = os.path.getsize(file_path)
-        chuck_count = file_size // CHUNK_SIZE + (
-            0 if file_size % CHUNK_SIZE == 0 else 1
-        )
-        with open(file_path, "rb") as f:
-            f.seek(index * CHUNK_SIZE)
-            data = f.read(CHUNK_SIZE)
+    async def _upload_slice(self, ukey: str, index: int, view: memoryview, sha1s: list[str]) -> str | None:
+        file_size = len(view)
+        chunk = view[index * CHUNK_SIZE : (index + 1) * CHUNK_SIZE]
+        # 只复制正在上传的这一片
+        data = bytes(chunk)
+        chunk.release()
         headers = self.client.headers.copy()
         headers.update(
             {
@@ -89,11 +97,10 @@ class Guild:
             }
         )
         if index == 0:
-            headers["x-richmedia-cumulatesha1"] = json.dumps(
-                ["1111111111111111111111111111111111111111"] * chuck_count
-            )
+            # 每一片结束时的累计 sha1, 服务端已有相同内容时可以跳过
+            headers["x-richmedia-cumulatesha1"] = json.dumps(sha1s)
 
-        if (index + 1) * CHUNK_SIZE >= os.path.getsize(file_path):
+        if index == len(sha1s) - 1:
             headers["x-richmedia-is-last-slice"] = "1"
 
         resp = await self.client.post(
@@ -102,21 +109,39 @@ class Guild:
             content=data,
             headers=headers,
         )
-        # print(resp.request.headers)
 
         if resp.status_code != 200 or resp.json()["retcode"] != 0:
             raise RuntimeError(f"Upload slice failed: {resp.text}")
         return resp.json().get("extend_info")
 
-    async def upload_image(self, file_path) -> str:
-        sha1 = get_cumulative_sha1(file_path, os.path.getsize(file_path))
-        file_size = os.path.getsize(file_path)
-        ukey = await self._apply_upload(sha1, size=file_size)
-        s = None
-        for i in range(
-            file_size // CHUNK_SIZE + (0 if file_size % CHUNK_SIZE == 0 else 1)
-        ):
-            s = await self._upload_slice(ukey, i, file_path)
+    async def upload_image(self, data: bytes | bytearray | memoryview | str | os.PathLike, *, window: int = 4) -> str:
+        """
+        data 可以是文件路径, 也可以是 bytes 等缓冲区. 文件用 mmap 读取, 不会整个读进内存.
+        window: 同时上传的分片数
+        """
+        if isinstance(data, (str, os.PathLike)):
+            with open(data, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    raise RuntimeError(f"文件为空: {data}")
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    with memoryview(mm) as view:
+                        return await self.__upload(view, window)
+        with memoryview(data) as view:
+            if len(view) == 0:
+                raise RuntimeError("图片为空")
+            with view.cast("B") as view:
+                return await self.__upload(view, window)
+
+    async def __upload(self, view: memoryview, window: int) -> str:
+        # hashlib 计算时会释放 GIL
+        sha1s = await asyncio.to_thread(get_cumulative_sha1s, view)
+        ukey = await self._apply_upload(sha1s[-1], size=len(view))
+        last = len(sha1s) - 1
+        if last > 0:
+            # 第一片带着 sha1 列表, 先传; 最后一片要等前面的都传完
+            await self._upload_slice(ukey, 0, view, sha1s)
+            await run_window(range(1, last), window, lambda i: self._upload_slice(ukey, i, view, sha1s))
+        s = await self._upload_slice(ukey, last, view, sha1s)
         if s == None:
             raise RuntimeError("Upload slice failed")
         j = json.loads(base64.b64decode(s))
@@ -167,22 +192,42 @@ class Guild:
         return resp.json()["data"]["feed"]["id"]
 
     async def delete_feed(self, guild_id: str, feed_id: str) -> None:
+        await self.delete_feeds(guild_id, [feed_id])
+
+    async def delete_feeds(self, guild_id: str, feed_ids: Iterable[str], batch_size: int = DELETE_BATCH) -> None:
+        """ 按 batch_size 个一批删除, 某一批失败时抛出异常, 之前的批次已经删除 """
         headers = self.client.headers.copy()
         headers["x-oidb"] = '{"uint32_service_type":1,"uint32_command":"0x91f9"}'
-        resp = await self.client.post(
-            "/qunng/guild/gotrpc/v1/trpc.group_pro.cmd0xf57.BatchOperateSvr/HandleProcess",
-            params={"bkn": self.get_bkn()},
-            json={
-                "guild_id": guild_id,
-                "operate_type": 2,
-                "include": {
-                    "feed_ids": [feed_id],
+        feed_ids = list(feed_ids)
+        for i in range(0, len(feed_ids), batch_size):
+            resp = await self.client.post(
+                "/qunng/guild/gotrpc/v1/trpc.group_pro.cmd0xf57.BatchOperateSvr/HandleProcess",
+                params={"bkn": self.get_bkn()},
+                json={
+                    "guild_id": guild_id,
+                    "operate_type": 2,
+                    "include": {
+                        "feed_ids": feed_ids[i : i + batch_size],
+                    },
                 },
-            },
-            headers=headers,
+                headers=headers,
+            )
+            if resp.json()["retcode"] != 0:
+                raise RuntimeError(f"Delete feed failed: {resp.text}")
+
+    def iter_feeds(
+        self, guild_id: str, channel_id: str, offset: int = 0, limit: int = 20
+    ) -> AsyncIterator[Feed]:
+        """
+        从 offset 开始逐条返回帖子, 处理当前页时会预先请求下一页. 跨页重复的帖子按 id 去掉.
+        一页不满 limit 或者没有新帖子时结束
+        """
+        return iter_pages(
+            lambda o: self.get_feeds(guild_id, channel_id, o, limit),
+            offset,
+            lambda o, feeds: o + len(feeds) if len(feeds) >= limit else None,
+            lambda f: f.id,
         )
-        if resp.json()["retcode"] != 0:
-            raise RuntimeError(f"Delete feed failed: {resp.text}")
 
     async def get_feeds(
         self, guild_id: str, channel_id: str, offset: int = 0, limit: int = 20
@@ -231,15 +276,24 @@ class Guild:
 
     # 实则和 Qzone 的 g_tk 一样
     def get_bkn(self) -> str:
-        p_skey = self.cookies["p_skey"]
-        hash_val = 5381
-        for i in range(len(p_skey)):
-            hash_val += (hash_val << 5) + ord(p_skey[i])
-        return str(hash_val & 2147483647)
+        return self.token
 
 
 def get_cumulative_sha1(file_path: str, end: int) -> str:
     sha1 = hashlib.sha1()
     with open(file_path, "rb") as f:
-        sha1.update(f.read(end))
+        while end > 0 and (chunk := f.read(min(CHUNK_SIZE, end))):
+            sha1.update(chunk)
+            end -= len(chunk)
     return sha1.hexdigest()
+
+
+def get_cumulative_sha1s(view: memoryview) -> list[str]:
+    """ 一次遍历算出每一片结束时的累计 sha1, 最后一个就是整个文件的 sha1 """
+    sha1 = hashlib.sha1()
+    sha1s = []
+    for i in range(0, len(view), CHUNK_SIZE):
+        with view[i : i + CHUNK_SIZE] as chunk:
+            sha1.update(chunk)
+        sha1s.append(sha1.hexdigest())
+    return sha1s
@@ -0,0 +1,214 @@
+import asyncio
+from typing import Any, AsyncGenerator, Awaitable, Callable, Hashable, Sequence
+
+import httpx
+from httpx import AsyncBaseTransport, AsyncClient
+
+
+def has_http2() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def make_transport(http2: bool | None = None) -> httpx.AsyncHTTPTransport:
+    """
+    Qzone / Guild 默认使用的连接池, 保持长连接避免每次请求都重新握手.
+    http2 为 None 时, 安装了 h2 (pip install httpx[http2]) 就启用 HTTP/2
+    """
+    return httpx.AsyncHTTPTransport(
+        http2=has_http2() if http2 == None else http2,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=120),
+        retries=1,
+    )
+
+
+class SharedTransport(AsyncBaseTransport):
+    """ 多个 client 共用一个连接池时使用, 关闭 client 不会关闭连接池 """
+
+    __inner: AsyncBaseTransport
+
+    def __init__(self, inner: AsyncBaseTransport):
+        self.__inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self.__inner.handle_async_request(request)
+
+    async def aclose(self):
+        pass
+
+
+def get_token(p_skey: str) -> str:
+    """ Qzone 的 g_tk, 频道的 bkn 都是这个 """
+    hash_val = 5381
+    for c in p_skey:
+        hash_val += (hash_val << 5) + ord(c)
+    return str(hash_val & 2147483647)
+
+
+async def run_window(items: Sequence, window: int, fn: Callable[..., Awaitable]):
+    """
+    对 items 依次调用 fn, 同时最多运行 window 个.
+    出错时取消其余的, 抛出第一个异常 (优先 RuntimeError), 调用的地方不需要处理 ExceptionGroup
+    """
+    it = iter(items)
+
+    async def worker():
+        for item in it:
+            await fn(item)
+
+    try:
+        async with asyncio.TaskGroup() as tg:
+            for _ in range(min(window, len(items))):
+                tg.create_task(worker())
+    except ExceptionGroup as eg:
+        raise (eg.subgroup(RuntimeError) or eg).exceptions[0]
+
+
+async def iter_pages(
+    fetch: Callable[[int], Awaitable[list]],
+    start: int,
+    advance: Callable[[int, list], int | None],
+    key: Callable[[Any], Hashable],
+) -> AsyncGenerator:
+    """
+    从 start 开始逐页调用 fetch 并逐条返回, 处理当前页时会预先请求下一页.
+    advance(当前位置, 这一页) 返回下一页的位置, 为 None 或者这一页没有新内容时结束.
+    跨页重复的按 key 去掉
+    """
+    seen = set()
+    task = asyncio.create_task(fetch(start))
+    try:
+        while task != None:
+            items = await task
+            new = [x for x in items if key(x) not in seen]
+            start = advance(start, items)
+            task = None
+            if new and start != None:
+                task = asyncio.create_task(fetch(start))
+            for x in new:
+                seen.add(key(x))
+                yield x
+    finally:
+        # 提前退出循环时取消预取
+        if task != None:
+            task.cancel()
+
+
+class Session:
+    """
+    Qzone / Guild 共用的部分: 管理 cookies 和由 p_skey 算出的 token.
+    指定了 refresh 时, 请求返回登录失效会重新获取 cookies 并重试一次.
+    请求体里带着 skey, p_skey 或 token 的请求不会自动重试, 需要自己用新的 cookies 重新构造.
+    """
+
+    uin: str
+    cookies: dict
+    client: AsyncClient
+    token: str
+    token_param: str = "g_tk"
+    """ URL 中携带 token 的参数名, 重试时会替换成新的 token """
+    refreshed: int
+    """ 刷新 cookies 的次数 """
+    __refresh: Callable[[], Awaitable[dict]] | None
+    __version: int
+    __lock: asyncio.Lock
+
+    def __init__(
+        self,
+        uin: str,
+        cookies: dict,
+        *,
+        transport: AsyncBaseTransport | None = None,
+        refresh: Callable[[], Awaitable[dict]] | None = None,
+        **client_kwargs,
+    ):
+        """
+        transport: 为 None 时使用自己的连接池, 否则共用传入的连接池, aclose 时不会关闭它
+        refresh: 重新获取 cookies 的协程函数, 一般是 Bot 调用 get_cookies
+        """
+        self.uin = uin
+        self.refreshed = 0
+        self.__refresh = refresh
+        self.__version = 0
+        self.__lock = asyncio.Lock()
+        self.client = AsyncClient(
+            timeout=60,
+            transport=make_transport() if transport == None else SharedTransport(transport),
+            auth=_RefreshAuth(self),
+            **client_kwargs,
+        )
+        self._set_cookies(cookies)
+
+    def _set_cookies(self, cookies: dict):
+        self.cookies = cookies
+        self.client.cookies = cookies
+        # 只在 cookies 变化时计算一次
+        self.token = get_token(cookies["p_skey"])
+
+    def _auth_failed(self, resp: httpx.Response) -> bool:
+        return resp.status_code in (401, 403)
+
+    async def refresh_cookies(self, version: int | None = None) -> bool:
+        """ version 是请求发出时的版本, 其他请求已经刷新过的话不再重复刷新 """
+        if self.__refresh == None:
+            return False
+        async with self.__lock:
+            if version == None or version == self.__version:
+                self._set_cookies(await self.__refresh())
+                self.__version += 1
+                self.refreshed += 1
+        return True
+
+    def _version(self) -> int:
+        return self.__version
+
+    def _has_credentials(self, content: bytes) -> bool:
+        """ 请求体里带着 skey, p_skey 或 token 时重放也没用, 要由调用的地方重新构造请求 """
+        values = [self.cookies.get("skey"), self.cookies.get("p_skey"), self.token]
+        return any(v and v.encode() in content for v in values)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.aclose()
+
+
+class _RefreshAuth(httpx.Auth):
+    __session: Session
+
+    def __init__(self, session: Session):
+        self.__session = session
+
+    async def async_auth_flow(self, request: httpx.Request) -> AsyncGenerator[httpx.Request, httpx.Response]:
+        session = self.__session
+        version = session._version()
+        response = yield request
+        # 重写了 async_auth_flow, requires_response_body 不会生效, 要自己读
+        await response.aread()
+        if not session._auth_failed(response):
+            return
+        try:
+            content = request.content
+        except httpx.RequestNotRead:
+            # 流式的请求体不能重放
+            return
+        if session._has_credentials(content):
+            return
+        if not await session.refresh_cookies(version):
+            return
+
+        url = request.url
+        if session.token_param in url.params:
+            url = url.copy_set_param(session.token_param, session.token)
+        headers = request.headers.copy()
+        headers.pop("Cookie", None)
+        retry = httpx.Request(request.method, url, headers=headers, content=content, extensions=request.extensions)
+        session.client.cookies.set_cookie_header(retry)
+        yield retry
@@ -0,0 +1,191 @@
+import json
+import re
+from typing import Any
+
+from botx.codec import get_codec
+
+# 严格的 JSON 先交给最快的已安装实现, 解析失败再用下面的宽松解析
+_strict = get_codec().loads
+
+_WS = re.compile(r"(?:\s+|//[^\n]*|/\*.*?\*/)*", re.S)
+_NUMBER = re.compile(r"[-+]?(?:0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)")
+_IDENT = re.compile(r"[A-Za-z_$][\w$]*")
+_STRING = {
+    '"': re.compile(r'"([^"\\]*(?:\\.[^"\\]*)*)"', re.S),
+    "'": re.compile(r"'([^'\\]*(?:\\.[^'\\]*)*)'", re.S),
+}
+_ESCAPE = re.compile(r"\\(u\{[0-9a-fA-F]+\}|u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|\r\n|.)", re.S)
+_ESCAPES = {
+    "n": "\n",
+    "t": "\t",
+    "r": "\r",
+    "b": "\b",
+    "f": "\f",
+    "v": "\v",
+    "0": "\0",
+    "\n": "",
+    "\r": "",
+    "\r\n": "",
+}
+_CONSTANTS = {
+    "true": True,
+    "false": False,
+    "null": None,
+    "undefined": None,
+    "NaN": float("nan"),
+    "Infinity": float("inf"),
+}
+
+
+def loads(text: str) -> Any:
+    """
+    解析 JSON, 不是严格的 JSON 时按 JS 字面量解析.
+    支持单引号字符串, 不带引号的键, 结尾多余的逗号, undefined, 十六进制数字和注释
+    """
+    try:
+        return _strict(text)
+    except ValueError:
+        pass
+    parser = _Parser(text)
+    value = parser.value()
+    parser.skip()
+    if parser.pos != len(text):
+        parser.fail("多余的内容")
+    return value
+
+
+def _unescape_one(m: re.Match) -> str:
+    s = m.group(1)
+    if len(s) > 1:
+        if s[0] == "u":
+            return chr(int(s[2:-1] if s[1] == "{" else s[1:], 16))
+        if s[0] == "x":
+            return chr(int(s[1:], 16))
+    return _ESCAPES.get(s, s)
+
+
+def _unescape(s: str) -> str:
+    if "\\" not in s:
+        return s
+    s = _ESCAPE.sub(_unescape_one, s)
+    # \uXXXX 写出的代理对要合成一个字符
+    try:
+        s.encode("utf-8")
+    except UnicodeEncodeError:
+        s = s.encode("utf-16", "surrogatepass").decode("utf-16", "replace")
+    return s
+
+
+class _Parser:
+    text: str
+    pos: int
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+
+    def fail(self, msg: str):
+        raise json.JSONDecodeError(msg, self.text, self.pos)
+
+    def skip(self):
+        self.pos = _WS.match(self.text, self.pos).end()
+
+    def value(self) -> Any:
+        self.skip()
+        text = self.text
+        if self.pos >= len(text):
+            self.fail("缺少值")
+        c = text[self.pos]
+        if c == "{":
+            return self.object()
+        if c == "[":
+            return self.array()
+        if c == '"' or c == "'":
+            return self.string(c)
+        m = _NUMBER.match(text, self.pos)
+        if m != None:
+            self.pos = m.end()
+            return _number(m.group())
+        if c == "-" and text.startswith("-Infinity", self.pos):
+            self.pos += 9
+            return float("-inf")
+        m = _IDENT.match(text, self.pos)
+        if m != None and m.group() in _CONSTANTS:
+            self.pos = m.end()
+            return _CONSTANTS[m.group()]
+        self.fail("无法解析的值")
+
+    def string(self, quote: str) -> str:
+        m = _STRING[quote].match(self.text, self.pos)
+        if m == None:
+            self.fail("字符串没有结束")
+        self.pos = m.end()
+        return _unescape(m.group(1))
+
+    def key(self) -> str:
+        c = self.text[self.pos]
+        if c == '"' or c == "'":
+            return self.string(c)
+        m = _IDENT.match(self.text, self.pos) or _NUMBER.match(self.text, self.pos)
+        if m == None:
+            self.fail("无法解析的键")
+        self.pos = m.end()
+        return m.group()
+
+    def object(self) -> dict:
+        text = self.text
+        obj = {}
+        self.pos += 1
+        while True:
+            self.skip()
+            if self.pos >= len(text):
+                self.fail("对象没有结束")
+            if text[self.pos] == "}":
+                self.pos += 1
+                return obj
+            key = self.key()
+            self.skip()
+            if not text.startswith(":", self.pos):
+                self.fail("缺少冒号")
+            self.pos += 1
+            obj[key] = self.value()
+            self.skip()
+            if text.startswith(",", self.pos):
+                self.pos += 1
+            elif not text.startswith("}", self.pos):
+                self.fail("缺少逗号")
+
+    def array(self) -> list:
+        text = self.text
+        arr = []
+        self.pos += 1
+        while True:
+            self.skip()
+            if self.pos >= len(text):
+                self.fail("数组没有结束")
+            c = text[self.pos]
+            if c == "]":
+                self.pos += 1
+                return arr
+            if c == ",":
+                # [1,,2] 中间空着的一项
+                arr.append(None)
+                self.pos += 1
+                continue
+            arr.append(self.value())
+            self.skip()
+            if text.startswith(",", self.pos):
+                self.pos += 1
+            elif not text.startswith("]", self.pos):
+                self.fail("缺少逗号")
+
+
+def _number(s: str) -> int | float:
+    body = s.lstrip("+-")
+    if body[:2] in ("0x", "0X"):
+        n = int(body, 16)
+    elif "." in body or "e" in body or "E" in body:
+        n = float(body)
+    else:
+        n = int(body)
+    return -n if s[0] == "-" else n
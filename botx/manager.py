@@ -0,0 +1,74 @@
+import asyncio
+
+import httpx
+
+from botx.bot import AccessTokenError, Bot
+from botx.codec import Codec, get_codec
+from botx.executor import HandlerExecutor
+from botx.http import make_transport
+
+
+class BotManager:
+    """
+    在一个事件循环里运行多个账号, 共用 JSON 实现, 同步处理函数的线程池和 HTTP 连接池.
+    每个账号的异常只会交给该账号的 on_error, 一个账号退出不会影响其他账号.
+    """
+
+    codec: Codec
+    executor: HandlerExecutor
+    http_transport: httpx.AsyncBaseTransport
+    bots: list[Bot]
+    log_level: str
+    __defaults: dict
+
+    def __init__(
+        self,
+        *,
+        codec: Codec | str = "json",
+        executor: HandlerExecutor | None = None,
+        http_transport: httpx.AsyncBaseTransport | None = None,
+        log_level="INFO",
+        **defaults,
+    ):
+        """ defaults 是每个 Bot 的默认参数, 见 Bot.__init__ """
+        self.codec = get_codec(codec) if isinstance(codec, str) else codec
+        self.executor = executor or HandlerExecutor(name="botx-manager")
+        self.http_transport = http_transport or make_transport()
+        self.bots = []
+        self.log_level = log_level
+        self.__defaults = defaults
+
+    def add(self, ws_uri: str | None = None, **kwargs) -> Bot:
+        """ 创建一个使用共享资源的 Bot """
+        bot = Bot(
+            ws_uri,
+            **{
+                "log_level": self.log_level,
+                **self.__defaults,
+                **kwargs,
+                "codec": self.codec,
+                "executor": self.executor,
+                "http_transport": self.http_transport,
+            },
+        )
+        self.bots.append(bot)
+        return bot
+
+    def factory(self, self_id: int) -> Bot:
+        """ 作为 Server 的 factory 使用: Server(factory=manager.factory) """
+        return self.add()
+
+    async def start(self):
+        """ 启动所有配置了 ws_uri 的账号 """
+        async with asyncio.TaskGroup() as tg:
+            for bot in self.bots:
+                if bot.ws_uri != None:
+                    tg.create_task(self.__run(bot))
+
+    async def __run(self, bot: Bot):
+        try:
+            await bot.start()
+        except AccessTokenError:
+            bot.getLogger().error(f"账号退出: {bot.ws_uri}: Access Token 错误")
+        except Exception as e:
+            bot.getLogger().exception(f"账号退出: {bot.ws_uri}: {e}")
@@ -1,5 +1,6 @@
 from .group import Group
 from .user import User
+from .segment import MessageSegment, MessageChain
 from .message import Message, PrivateMessage, GroupMessage
 from .notice import (
     Notice,
@@ -8,7 +9,10 @@ from .notice import (
     GroupRecall,
     FriendAdd,
     GroupIncrease,
+    GroupDecrease,
     EmojiLike,
+    Poke,
 )
 from .request import Request, FriendRequest, GroupRequest
+from .info import GroupInfo, Stranger, Member
 from .command import Command
@@ -1,6 +1,7 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Callable
 
+from botx.executor import Handler
 from .message import Message, GroupMessage
 
 @dataclass
@@ -13,12 +14,42 @@ class Command:
     admin: bool
     help_msg: str
     targets: list[str | int]
-    
+    handler: Handler
+
+    groups: frozenset[int] = field(init=False, repr=False)
+    users: frozenset[int] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        # 注册时把 targets 归一化成 id 集合, 分发时只做集合查询
+        groups, users = set(), set()
+        for t in self.targets:
+            if isinstance(t, str):
+                (groups if t[0] == "g" else users).add(int(t[1:]))
+            elif issubclass(self.cmd_type, GroupMessage):
+                groups.add(t)
+            else:
+                users.add(t)
+        self.groups = frozenset(groups)
+        self.users = frozenset(users)
+
+    def ids(self, msg_type: type) -> frozenset[int] | None:
+        """ 这个指令对 msg_type 生效的群号 / QQ号, None 表示所有目标 """
+        if not self.targets:
+            return None
+        return self.groups if issubclass(msg_type, GroupMessage) else self.users
+
+    def overlaps(self, other: "Command", msg_type: type) -> bool:
+        """ 两个指令对 msg_type 是否有共同的目标 """
+        a, b = self.ids(msg_type), other.ids(msg_type)
+        if a == None:
+            return b == None or len(b) > 0
+        if b == None:
+            return len(a) > 0
+        return not a.isdisjoint(b)
+
     def is_target(self, msg: Message):
         if not self.targets:
             return True
         if isinstance(msg, GroupMessage):
-            is_target = any(map(lambda t: t == f"g{msg.group_id}" or t == msg.group_id, self.targets))
-        else:
-            is_target = any(map(lambda t: t == f"p{msg.sender.user_id}" or t == msg.sender.user_id, self.targets))
-        return is_target
\ No newline at end of file
+            return msg.group_id in self.groups
+        return msg.sender.user_id in self.users
@@ -0,0 +1,89 @@
+import dataclasses
+import itertools
+import types
+import typing
+from typing import Any, Callable
+
+from .message import PrivateMessage, GroupMessage
+from .notice import notices
+from .request import requests
+from .info import infos
+
+# 为每个 dataclass 生成一个专用的解码函数, 代替 dataclasses_json 的反射解码.
+# 行为与 from_dict 保持一致: 忽略多余的键, 缺少必填字段时抛出 KeyError,
+# 对 int / float / str 字段做类型转换.
+
+_decoders: dict[type, Callable[[dict], Any]] = {}
+_COERCE = (int, float, str)
+
+
+def _coerce(t: type, v):
+    return v if v == None else t(v)
+
+
+def get_decoder(cls: type) -> Callable[[dict], Any]:
+    decoder = _decoders.get(cls)
+    if decoder == None:
+        decoder = _decoders[cls] = _compile(cls)
+    return decoder
+
+
+def decode(cls: type, data: dict) -> Any:
+    return get_decoder(cls)(data)
+
+
+def _compile(cls: type) -> Callable[[dict], Any]:
+    hints = typing.get_type_hints(cls)
+    ns: dict[str, Any] = {"cls": cls, "_coerce": _coerce}
+    names = (f"_v{i}" for i in itertools.count())
+    args = []
+    for f in dataclasses.fields(cls):
+        if not f.init:
+            continue
+        if f.default is not dataclasses.MISSING:
+            ns[f"_default_{f.name}"] = f.default
+            get = f'd.get("{f.name}", _default_{f.name})'
+        elif f.default_factory is not dataclasses.MISSING:
+            ns[f"_factory_{f.name}"] = f.default_factory
+            get = f'(d["{f.name}"] if "{f.name}" in d else _factory_{f.name}())'
+        else:
+            get = f'd["{f.name}"]'
+        args.append(f"{f.name}={_convert(hints[f.name], get, ns, names)}")
+    src = f"def decode(d):\n    return cls({', '.join(args)})\n"
+    exec(src, ns)
+    decoder = ns["decode"]
+    decoder.__qualname__ = f"decode_{cls.__qualname__}"
+    return decoder
+
+
+def _convert(tp, expr: str, ns: dict, names) -> str:
+    origin = typing.get_origin(tp)
+    if origin in (typing.Union, types.UnionType):
+        args = [a for a in typing.get_args(tp) if a is not type(None)]
+        if len(args) == 1:
+            v = next(names)
+            inner = _convert(args[0], v, ns, names)
+            if inner == v:
+                return expr
+            return f"(None if ({v} := {expr}) == None else {inner})"
+        return expr
+    if origin is list:
+        (arg,) = typing.get_args(tp) or (Any,)
+        v = next(names)
+        inner = _convert(arg, v, ns, names)
+        if inner == v:
+            return expr
+        return f"[{inner} for {v} in {expr}]"
+    if dataclasses.is_dataclass(tp):
+        name = f"_decode_{tp.__name__}_{id(tp)}"
+        ns[name] = get_decoder(tp)
+        return f"{name}({expr})"
+    if tp in _COERCE:
+        v = next(names)
+        ns[tp.__name__] = tp
+        return f"({v} if ({v} := {expr}).__class__ is {tp.__name__} else _coerce({tp.__name__}, {v}))"
+    return expr
+
+
+for _cls in [PrivateMessage, GroupMessage, *notices, *requests, *infos]:
+    get_decoder(_cls)
@@ -0,0 +1,51 @@
+from dataclasses import dataclass
+from dataclasses_json import dataclass_json
+
+
+@dataclass_json
+@dataclass(frozen=True, slots=True)
+class GroupInfo:
+    """ get_group_info 的返回值 """
+
+    group_id: int
+    group_name: str
+    member_count: int = 0
+    max_member_count: int = 0
+
+
+@dataclass_json
+@dataclass(frozen=True, slots=True)
+class Stranger:
+    """ get_stranger_info 的返回值 """
+
+    user_id: int
+    nickname: str
+    sex: str = "unknown"
+    age: int = 0
+
+
+@dataclass_json
+@dataclass(frozen=True, slots=True)
+class Member:
+    """ get_group_member_info 的返回值, 各个 Onebot 实现返回的字段不完全一样, 只保留常用的 """
+
+    group_id: int
+    user_id: int
+    nickname: str
+    card: str = ""
+    sex: str = "unknown"
+    age: int = 0
+    join_time: int = 0
+    last_sent_time: int = 0
+    level: str = ""
+    role: str = "member"
+    """ owner, admin, member """
+    title: str = ""
+
+    @property
+    def name(self) -> str:
+        """ 群名片, 没有设置时为昵称 """
+        return self.card or self.nickname
+
+
+infos = [GroupInfo, Stranger, Member]
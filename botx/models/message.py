@@ -1,6 +1,7 @@
-from dataclasses import dataclass
-from dataclasses_json import dataclass_json
+from dataclasses import dataclass, field
+from dataclasses_json import config, dataclass_json
 
+from botx.models.segment import MessageChain, MessageSegment
 from botx.models.user import User
 
 
@@ -16,19 +17,37 @@ class Message:
     message: dict | list
     raw_message: str
 
-    async def reply(self, msg: str):
+    _chain: MessageChain | None = field(
+        default=None, init=False, repr=False, compare=False, metadata=config(exclude=lambda _: True)
+    )
+
+    @property
+    def chain(self) -> MessageChain:
+        """ 第一次访问时才从 message 转换 """
+        if self._chain == None:
+            object.__setattr__(self, "_chain", MessageChain.parse(self.message))
+        return self._chain
+
+    async def reply(self, msg: str | MessageSegment | MessageChain):
         raise NotImplementedError()
 
 
+def _with_reply(id: int, msg: str | MessageSegment | MessageChain) -> str | MessageChain:
+    # 字符串里可能有 CQ 码, 保持原样拼接; 消息链直接以数组格式发送
+    if isinstance(msg, str):
+        return f"[CQ:reply,id={id}]{msg}"
+    return MessageSegment.reply(id) + msg
+
+
 @dataclass_json
 @dataclass(frozen=True, slots=True, unsafe_hash=True)
 class PrivateMessage(Message):
 
-    async def reply(self, msg: str) -> int | None:
+    async def reply(self, msg: str | MessageSegment | MessageChain) -> int | None:
         from botx.bot import get_bot
 
         return await get_bot(self.self_id).send_private(
-            user=self.sender, msg=f"[CQ:reply,id={self.message_id}]{msg}"
+            user=self.sender, msg=_with_reply(self.message_id, msg)
         )
 
 
@@ -37,9 +56,9 @@ class PrivateMessage(Message):
 class GroupMessage(Message):
     group_id: int
 
-    async def reply(self, msg: str) -> int | None:
+    async def reply(self, msg: str | MessageSegment | MessageChain) -> int | None:
         from botx.bot import get_bot
 
         return await get_bot(self.self_id).send_group(
-            group=self.group_id, msg=f"[CQ:reply,id={self.message_id}]{msg}"
+            group=self.group_id, msg=_with_reply(self.message_id, msg)
         )
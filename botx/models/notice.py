@@ -81,6 +81,18 @@ class EmojiLike(Notice):
         count: int
 
 
+@dataclass_json
+@dataclass(frozen=True, slots=True)
+class Poke(Notice):
+    notice_type = "notify"
+    notice_sub_type = "poke"
+
+    user_id: int
+    target_id: int
+    group_id: int | None = None
+    """ 私聊戳一戳时为 None """
+
+
 notices = [
     clazz
     for _, clazz in globals().items()
@@ -0,0 +1,176 @@
+import re
+from typing import Iterable
+
+# OneBot 11 CQ 码: [CQ:类型,参数=值,...]
+_CQ = re.compile(r"\[CQ:([^,\]]+)((?:,[^,\]]*)*)\]")
+
+
+def escape(s: str, comma: bool = False) -> str:
+    """ 转义 CQ 码里的特殊字符, comma 为 True 时用于参数值 """
+    if "&" in s:
+        s = s.replace("&", "&amp;")
+    if "[" in s:
+        s = s.replace("[", "&#91;")
+    if "]" in s:
+        s = s.replace("]", "&#93;")
+    if comma and "," in s:
+        s = s.replace(",", "&#44;")
+    return s
+
+
+def unescape(s: str) -> str:
+    if "&" not in s:
+        return s
+    # &amp; 最后替换, 否则 "&amp;#91;" 会被还原成 "["
+    return (
+        s.replace("&#44;", ",")
+        .replace("&#91;", "[")
+        .replace("&#93;", "]")
+        .replace("&amp;", "&")
+    )
+
+
+class MessageSegment:
+    """ 消息段, 对应数组格式中的一项 {"type": ..., "data": {...}} """
+
+    __slots__ = ("type", "data")
+
+    type: str
+    data: dict
+
+    def __init__(self, type: str, data: dict | None = None):
+        self.type = type
+        self.data = data if data != None else {}
+
+    @staticmethod
+    def text(text: str) -> "MessageSegment":
+        return MessageSegment("text", {"text": text})
+
+    @staticmethod
+    def at(qq: int | str) -> "MessageSegment":
+        """ qq 为 "all" 时 @全体成员 """
+        return MessageSegment("at", {"qq": str(qq)})
+
+    @staticmethod
+    def reply(id: int) -> "MessageSegment":
+        return MessageSegment("reply", {"id": str(id)})
+
+    @staticmethod
+    def face(id: int) -> "MessageSegment":
+        return MessageSegment("face", {"id": str(id)})
+
+    @staticmethod
+    def image(file: str) -> "MessageSegment":
+        """ file 可以是 URL, file:// 路径或 base64:// """
+        return MessageSegment("image", {"file": file})
+
+    @staticmethod
+    def from_dict(d: dict) -> "MessageSegment":
+        return MessageSegment(d["type"], d.get("data") or {})
+
+    def to_dict(self) -> dict:
+        return {"type": self.type, "data": self.data}
+
+    def to_cq(self) -> str:
+        if self.type == "text":
+            return escape(self.data.get("text", ""))
+        params = "".join(
+            f",{k}={escape(str(v), comma=True)}"
+            for k, v in self.data.items()
+            if v != None
+        )
+        return f"[CQ:{self.type}{params}]"
+
+    def __add__(self, other) -> "MessageChain":
+        return MessageChain([self]) + other
+
+    def __radd__(self, other) -> "MessageChain":
+        return MessageChain.of(other) + self
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, MessageSegment)
+            and self.type == other.type
+            and self.data == other.data
+        )
+
+    def __repr__(self):
+        return f"MessageSegment({self.type!r}, {self.data!r})"
+
+
+class MessageChain(list[MessageSegment]):
+    """ 消息链, 可以直接传给 send_private / send_group / reply, 以数组格式发送 """
+
+    __slots__ = ()
+
+    @staticmethod
+    def of(msg: "str | MessageSegment | Iterable[MessageSegment] | None") -> "MessageChain":
+        """ 字符串视为纯文本, 不解析 CQ 码; 需要解析请用 from_cq """
+        if msg == None:
+            return MessageChain()
+        if isinstance(msg, MessageChain):
+            return msg
+        if isinstance(msg, str):
+            return MessageChain([MessageSegment.text(msg)]) if msg else MessageChain()
+        if isinstance(msg, MessageSegment):
+            return MessageChain([msg])
+        return MessageChain(msg)
+
+    @staticmethod
+    def from_cq(s: str) -> "MessageChain":
+        """ 一次扫描解析 CQ 码字符串 """
+        chain = MessageChain()
+        pos = 0
+        for m in _CQ.finditer(s):
+            if m.start() > pos:
+                chain.append(MessageSegment("text", {"text": unescape(s[pos:m.start()])}))
+            data = {}
+            if m.group(2):
+                for param in m.group(2)[1:].split(","):
+                    k, _, v = param.partition("=")
+                    data[k] = unescape(v)
+            chain.append(MessageSegment(m.group(1), data))
+            pos = m.end()
+        if pos < len(s):
+            chain.append(MessageSegment("text", {"text": unescape(s[pos:])}))
+        return chain
+
+    @staticmethod
+    def from_array(array: list[dict]) -> "MessageChain":
+        return MessageChain([MessageSegment(d["type"], d.get("data") or {}) for d in array])
+
+    @staticmethod
+    def parse(message: str | list | dict) -> "MessageChain":
+        """ 解析 Onebot 上报的 message, 字符串和数组格式都可以 """
+        if isinstance(message, str):
+            return MessageChain.from_cq(message)
+        if isinstance(message, dict):
+            return MessageChain([MessageSegment.from_dict(message)])
+        return MessageChain.from_array(message)
+
+    def to_array(self) -> list[dict]:
+        return [{"type": seg.type, "data": seg.data} for seg in self]
+
+    def to_cq(self) -> str:
+        return "".join(seg.to_cq() for seg in self)
+
+    def plain_text(self) -> str:
+        return "".join(seg.data.get("text", "") for seg in self if seg.type == "text")
+
+    def __add__(self, other) -> "MessageChain":
+        chain = MessageChain(self)
+        chain.extend(MessageChain.of(other))
+        return chain
+
+    def __radd__(self, other) -> "MessageChain":
+        return MessageChain.of(other) + self
+
+    def __iadd__(self, other) -> "MessageChain":
+        self.extend(MessageChain.of(other))
+        return self
+
+    def __str__(self):
+        return self.to_cq()
+
+    def __repr__(self):
+        return f"MessageChain({list.__repr__(self)})"
@@ -1,17 +1,41 @@
-from venv import logger
-import demjson3
+import asyncio
+import logging
 import math
+import mmap
 import time
 import base64
 import hashlib
+import inspect
 import os
 import random
-from typing import Any
+import re
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable
 
-from httpx import AsyncClient
+import httpx
+from httpx import AsyncBaseTransport
+
+from botx import jsonp
+from botx.http import Session, iter_pages, run_window
 
 UA = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
 
+# 原图分片上传的默认分片大小, 服务端在 FileBatchControl 的响应里指定了的话以服务端为准
+SLICE_SIZE = 16384
+# 超过这个大小的分片放到线程里编码
+_ENCODE_OFFLOAD = 1 << 18
+# 超过这个长度的响应放到线程里解析
+_DECODE_OFFLOAD = 1 << 18
+
+logger = logging.getLogger("Qzone")
+
+# 相册 / 照片索引的有效期, 按名字查不到且索引超过这个时间时才重新拉取
+INDEX_TTL = 60
+# 列出照片时每页的数量
+PAGE_SIZE = 500
+
+# 流式上传时每次读取的字节数, 是 3 的倍数, base64 编码时不需要拼接
+READ_SIZE = 3 << 16
+
 
 class QzoneImage:
     pic_bo: str
@@ -60,6 +84,52 @@ class RawImage(QzoneImage):
         return cls(pic_bo=pic_bo, richval=richval)
 
 
+class _PhotoIndex:
+    photos: dict[str, dict]
+    """ 照片名 -> cgi_list_photo 返回的照片信息 """
+    loaded: float
+    dirty: bool
+    """ 上传过照片, 索引里可能缺少新照片 """
+
+    def __init__(self):
+        self.photos = {}
+        self.loaded = 0
+        self.dirty = True
+
+
+class UploadedFile:
+    path: str
+    name: str | None
+    """ 照片在相册里的名字, 失败时为 None """
+    error: Exception | None
+
+    def __init__(self, path: str, name: str | None = None, error: Exception | None = None):
+        self.path = path
+        self.name = name
+        self.error = error
+
+
+class UploadResult:
+    """ upload_raw_images 的结果, 顺序和传入的文件一致 """
+
+    files: list[UploadedFile]
+
+    def __init__(self, files: list[UploadedFile]):
+        self.files = files
+
+    @property
+    def ok(self) -> bool:
+        return all(f.error == None for f in self.files)
+
+    @property
+    def succeeded(self) -> list[UploadedFile]:
+        return [f for f in self.files if f.error == None]
+
+    @property
+    def failed(self) -> list[UploadedFile]:
+        return [f for f in self.files if f.error != None]
+
+
 class Emotion:
     key: str
     uin: str
@@ -73,55 +143,57 @@ class Emotion:
         self.abstime = abstime
 
 
-class Qzone:
-    uin: str
-    cookies: dict
-    client: AsyncClient
+# Qzone 登录失效时返回 {"code":-3000,"message":"请先登录空间"}, 状态码仍是 200
+_LOGIN_EXPIRED = re.compile(r'"?(?:code|ret)"?\s*:\s*-3000\b')
 
-    def __init__(self, uin: str, cookies: dict):
-        self.uin = uin
-        self.cookies = cookies
-        self.client = AsyncClient(
-            cookies=cookies,
+
+class Qzone(Session):
+    token_param = "g_tk"
+    __albums: dict[str, str]
+    """ 相册名 -> 相册 id """
+    __albums_loaded: float
+    __photo_index: dict[str, _PhotoIndex]
+    __index_lock: asyncio.Lock
+
+    def __init__(
+        self,
+        uin: str,
+        cookies: dict,
+        transport: AsyncBaseTransport | None = None,
+        refresh: Callable[[], Awaitable[dict]] | None = None,
+    ):
+        super().__init__(
+            uin,
+            cookies,
+            transport=transport,
+            refresh=refresh,
             headers={
                 "Referer": "https://user.qzone.qq.com/",
                 "Origin": "https://user.qzone.qq.com",
                 "User-Agent": UA,
             },
-            timeout=60,
-        )
-
-    async def upload_image(self, data: bytes) -> QzoneImage:
-        resp = await self.client.post(
-            "https://up.qzone.qq.com/cgi-bin/upload/cgi_upload_image",
-            params={"g_tk": self.get_g_tk(), "uin": self.uin},
-            data={
-                "filename": "filename",
-                "zzpanelkey": "",
-                "uploadtype": "1",
-                "albumtype": "7",
-                "exttype": "0",
-                "skey": self.cookies["skey"],
-                "zzpaneluin": self.uin,
-                "p_uin": self.uin,
-                "uin": self.uin,
-                "p_skey": self.cookies["p_skey"],
-                "output_type": "json",
-                "qzonetoken": "",
-                "refer": "shuoshuo",
-                "charset": "utf-8",
-                "output_charset": "utf-8",
-                "upload_hd": "1",
-                "hd_width": "2048",
-                "hd_height": "10000",
-                "hd_quality": "96",
-                "backUrls": "http://upbak.photo.qzone.qq.com/cgi-bin/upload/cgi_upload_image,"
-                "http://119.147.64.75/cgi-bin/upload/cgi_upload_image",
-                "url": f"https://up.qzone.qq.com/cgi-bin/upload/cgi_upload_image?g_tk={self.get_g_tk()}",
-                "base64": "1",
-                "picfile": base64.b64encode(data).decode(),
-            },
         )
+        self.__albums = {}
+        self.__albums_loaded = -math.inf
+        self.__photo_index = {}
+        self.__index_lock = asyncio.Lock()
+
+    def _auth_failed(self, resp: httpx.Response) -> bool:
+        return super()._auth_failed(resp) or _LOGIN_EXPIRED.search(resp.text[:256]) != None
+
+    async def upload_image(self, data: bytes | str | os.PathLike | AsyncIterable[bytes]) -> QzoneImage:
+        """
+        data 可以是图片的内容, 文件路径或者异步的字节流.
+        请求体以 multipart 分块发送, 边读边编码, 不会把整张图片的 base64 放进内存
+        """
+        # 字节流只能读一次, cookies 失效时不能重试
+        attempts = 1 if isinstance(data, AsyncIterable) else 2
+        for attempt in range(attempts):
+            version = self._version()
+            resp = await self.__post_image(data)
+            if attempt + 1 < attempts and self._auth_failed(resp) and await self.refresh_cookies(version):
+                continue
+            break
         if resp.status_code == 200:
             r = load_resp(resp.text)
             if r.get("ret") != 0:
@@ -130,6 +202,58 @@ class Qzone:
         else:
             raise RuntimeError(f"上传图片失败[{resp.status_code}]:{resp.text}")
 
+    async def __post_image(self, data: bytes | str | os.PathLike | AsyncIterable[bytes]) -> httpx.Response:
+        boundary = base64.b32encode(random.randbytes(15)).decode()
+        fields = {
+            "filename": "filename",
+            "zzpanelkey": "",
+            "uploadtype": "1",
+            "albumtype": "7",
+            "exttype": "0",
+            "skey": self.cookies["skey"],
+            "zzpaneluin": self.uin,
+            "p_uin": self.uin,
+            "uin": self.uin,
+            "p_skey": self.cookies["p_skey"],
+            "output_type": "json",
+            "qzonetoken": "",
+            "refer": "shuoshuo",
+            "charset": "utf-8",
+            "output_charset": "utf-8",
+            "upload_hd": "1",
+            "hd_width": "2048",
+            "hd_height": "10000",
+            "hd_quality": "96",
+            "backUrls": "http://upbak.photo.qzone.qq.com/cgi-bin/upload/cgi_upload_image,"
+            "http://119.147.64.75/cgi-bin/upload/cgi_upload_image",
+            "url": f"https://up.qzone.qq.com/cgi-bin/upload/cgi_upload_image?g_tk={self.get_g_tk()}",
+            "base64": "1",
+        }
+        head = "".join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'
+            for k, v in fields.items()
+        )
+        head += f'--{boundary}\r\nContent-Disposition: form-data; name="picfile"\r\n\r\n'
+        tail = f"\r\n--{boundary}--\r\n".encode()
+        head = head.encode()
+
+        headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            size = len(data)
+        elif isinstance(data, (str, os.PathLike)):
+            size = get_len(data)
+        else:
+            size = None
+        if size != None:
+            headers["Content-Length"] = str(len(head) + 4 * math.ceil(size / 3) + len(tail))
+
+        return await self.client.post(
+            "https://up.qzone.qq.com/cgi-bin/upload/cgi_upload_image",
+            params={"g_tk": self.get_g_tk(), "uin": self.uin},
+            content=_form_stream(head, _read_chunks(data), tail),
+            headers=headers,
+        )
+
     async def publish(self, text: str, images: list[QzoneImage] = []) -> str:
         if not text and not images:
             return ""
@@ -174,11 +298,7 @@ class Qzone:
             raise RuntimeError(resp.text)
 
     def get_g_tk(self) -> str:
-        p_skey = self.cookies["p_skey"]
-        hash_val = 5381
-        for i in range(len(p_skey)):
-            hash_val += (hash_val << 5) + ord(p_skey[i])
-        return str(hash_val & 2147483647)
+        return self.token
 
     async def _get_session(
         self,
@@ -188,61 +308,77 @@ class Qzone:
         total: int,
         index: int,
         iBatchID: int,
-    ) -> str:
-        file_md5 = get_md5(file_path)
-
-        p = {
-            "control_req": [
-                {
-                    "uin": self.uin,
-                    "token": {
-                        "type": 4,
-                        "data": self.cookies["p_skey"],
-                        "appid": 5,
-                    },
-                    "appid": "pic_qzone",
-                    "checksum": file_md5,
-                    "check_type": 0,
-                    "file_len": get_len(file_path),
-                    "env": {"refer": "qzone", "deviceInfo": "h5"},
-                    "model": 0,
-                    "biz_req": {
-                        "sPicTitle": name,
-                        "sPicDesc": "",
-                        "sAlbumID": album_id,
-                        "iAlbumTypeID": 0,
-                        "iBitmap": 0,
-                        "iUploadType": 3,  # 原图
-                        "iUpPicType": 0 if total == 1 else 1,
-                        "iBatchID": iBatchID,
-                        "sPicPath": "",
-                        "iPicWidth": 0,
-                        "iPicHight": 0,
-                        "iWaterType": 0,
-                        "iDistinctUse": 0,
-                        "iNeedFeeds": 1,
-                        "iUploadTime": int(time.time()),
-                        "mutliPicInfo": {
-                            "iBatUploadNum": total,
-                            "iCurUpload": index,
-                            "iSuccNum": index,
-                            "iFailNum": 0,
+    ) -> tuple[str, int]:
+        """ 返回上传会话和分片大小 """
+        file_md5 = await asyncio.to_thread(get_md5, file_path)
+
+        # 请求体里带着 p_skey, cookies 失效时要用新的 p_skey 重新构造请求
+        for attempt in range(2):
+            version = self._version()
+            p = {
+                "control_req": [
+                    {
+                        "uin": self.uin,
+                        "token": {
+                            "type": 4,
+                            "data": self.cookies["p_skey"],
+                            "appid": 5,
                         },
-                    },
-                    "session": "",
-                    "asy_upload": 0,
-                    "cmd": "FileUpload",
-                }
-            ]
-        }
-        resp = await self.client.post(
-            f"https://h5.qzone.qq.com/webapp/json/sliceUpload/FileBatchControl/{file_md5}",
-            params={"g_tk": self.get_g_tk()},
-            json=p,
-        )
-        return resp.json()["data"]["session"]
+                        "appid": "pic_qzone",
+                        "checksum": file_md5,
+                        "check_type": 0,
+                        "file_len": get_len(file_path),
+                        "env": {"refer": "qzone", "deviceInfo": "h5"},
+                        "model": 0,
+                        "biz_req": {
+                            "sPicTitle": name,
+                            "sPicDesc": "",
+                            "sAlbumID": album_id,
+                            "iAlbumTypeID": 0,
+                            "iBitmap": 0,
+                            "iUploadType": 3,  # 原图
+                            "iUpPicType": 0 if total == 1 else 1,
+                            "iBatchID": iBatchID,
+                            "sPicPath": "",
+                            "iPicWidth": 0,
+                            "iPicHight": 0,
+                            "iWaterType": 0,
+                            "iDistinctUse": 0,
+                            "iNeedFeeds": 1,
+                            "iUploadTime": int(time.time()),
+                            "mutliPicInfo": {
+                                "iBatUploadNum": total,
+                                "iCurUpload": index,
+                                "iSuccNum": index,
+                                "iFailNum": 0,
+                            },
+                        },
+                        "session": "",
+                        "asy_upload": 0,
+                        "cmd": "FileUpload",
+                    }
+                ]
+            }
+            resp = await self.client.post(
+                f"https://h5.qzone.qq.com/webapp/json/sliceUpload/FileBatchControl/{file_md5}",
+                params={"g_tk": self.get_g_tk()},
+                json=p,
+            )
+            if attempt == 0 and self._auth_failed(resp) and await self.refresh_cookies(version):
+                continue
+            break
+        data = resp.json()["data"]
+        return data["session"], int(data.get("slice_size") or SLICE_SIZE)
 
     async def get_album(self, name) -> str | None:
+        """ 查询已缓存的相册列表, 查不到且缓存超过 INDEX_TTL 秒时重新拉取 """
+        if name not in self.__albums and time.monotonic() - self.__albums_loaded > INDEX_TTL:
+            async with self.__index_lock:
+                if name not in self.__albums and time.monotonic() - self.__albums_loaded > INDEX_TTL:
+                    await self.__load_albums()
+        return self.__albums.get(name)
+
+    async def __load_albums(self):
         resp = await self.client.get(
             "https://user.qzone.qq.com/proxy/domain/photo.qzone.qq.com/fcgi-bin/fcg_list_album_v3",
             params={
@@ -253,32 +389,65 @@ class Qzone:
                 "outCharset": "utf-8",
             },
         )
-        d = load_resp(resp.text)
-        for album in d["data"]["albumListModeSort"]:
-            if album["name"] == name:
-                return album["id"]
-        return None
+        d = await load_resp_async(resp.text)
+        albums = {}
+        for album in d["data"].get("albumListModeSort") or []:
+            # 重名时和以前一样取第一个
+            albums.setdefault(album["name"], album["id"])
+        self.__albums = albums
+        self.__albums_loaded = time.monotonic()
 
     async def get_image(self, album_id: str, name: str) -> QzoneImage | None:
-        resp = await self.client.get(
-            "https://h5.qzone.qq.com/proxy/domain/photo.qzone.qq.com/fcgi-bin/cgi_list_photo",
-            params={
-                "g_tk": self.get_g_tk(),
-                "hostUin": self.uin,
-                "uin": self.uin,
-                "inCharset": "utf-8",
-                "outCharset": "utf-8",
-                "topicId": album_id,
-                "pageStart": 0,
-                "pageNum": 500,
-            },
-        )
-
-        data = load_resp(resp.text)
-        for p in data["data"]["photoList"]:
-            if p["name"] == name:
-                return RawImage.parse(p, album_id=album_id)
-        return None
+        """
+        第一次查询某个相册时拉取全部照片, 之后只在查不到, 并且上传过照片或者索引过期时增量拉取
+        """
+        index = self.__photo_index.setdefault(album_id, _PhotoIndex())
+        if name not in index.photos and (index.dirty or time.monotonic() - index.loaded > INDEX_TTL):
+            async with self.__index_lock:
+                if name not in index.photos and (index.dirty or time.monotonic() - index.loaded > INDEX_TTL):
+                    await self.__load_photos(album_id, index)
+        p = index.photos.get(name)
+        return RawImage.parse(p, album_id=album_id) if p != None else None
+
+    async def __load_photos(self, album_id: str, index: _PhotoIndex):
+        # 已经有索引时只拉到没有新照片的那一页为止
+        full = not index.photos
+        start = 0
+        while True:
+            resp = await self.client.get(
+                "https://h5.qzone.qq.com/proxy/domain/photo.qzone.qq.com/fcgi-bin/cgi_list_photo",
+                params={
+                    "g_tk": self.get_g_tk(),
+                    "hostUin": self.uin,
+                    "uin": self.uin,
+                    "inCharset": "utf-8",
+                    "outCharset": "utf-8",
+                    "topicId": album_id,
+                    "pageStart": start,
+                    "pageNum": PAGE_SIZE,
+                },
+            )
+            data = (await load_resp_async(resp.text))["data"]
+            photos = data.get("photoList") or []
+            new = 0
+            for p in photos:
+                if p["name"] not in index.photos:
+                    index.photos[p["name"]] = p
+                    new += 1
+            start += len(photos)
+            total = data.get("totalInAlbum") or 0
+            if len(photos) < PAGE_SIZE or (total and start >= total) or (not full and new == 0):
+                break
+        index.loaded = time.monotonic()
+        index.dirty = False
+
+    def invalidate_index(self, album_id: str | None = None):
+        """ 在其他地方修改了相册后调用, album_id 为 None 时清空所有索引 """
+        if album_id == None:
+            self.__albums_loaded = -math.inf
+            self.__photo_index.clear()
+        else:
+            self.__photo_index.pop(album_id, None)
 
     async def delete_image(self, image: QzoneImage):
         data = image.richval.split(",")
@@ -306,27 +475,64 @@ class Qzone:
                 "qzreferrer": f"https://user.qzone.qq.com/proxy/domain/qzs.qq.com/qzone/photo/v7/page/photo.html?init=photo.v7/module/photoList2/index&navBar=1&normal=1&aid={data[1]}&g_iframeUser=1",
             },
         )
+        index = self.__photo_index.get(data[1])
+        if index != None:
+            for name in [n for n, p in index.photos.items() if p.get("lloc") == data[2]]:
+                del index.photos[name]
 
-    async def _upload_raw_image(self, file_path: str, session: str):
-        slice_size = 16384
-
+    async def _upload_raw_image(
+        self,
+        file_path: str,
+        session: str,
+        slice_size: int = SLICE_SIZE,
+        window: int = 4,
+        retries: int = 3,
+    ):
+        """
+        window: 同时上传的分片数
+        retries: 每个分片失败后的重试次数, 重试时请求里的 retry 字段为第几次重试
+        """
         total_size = get_len(file_path)
-        with open(file_path, "rb") as f:
-            # 计算总片数
-            total_slices = math.ceil(total_size / slice_size)
-
-            # 循环读取并上传每片
-            for seq in range(0, total_slices):
-                offset = seq * slice_size
-                data = base64.b64encode(f.read(slice_size)).decode("utf-8")
-                end = min(offset + slice_size, total_size)
-                await self.client.post(
+        if total_size == 0:
+            raise RuntimeError(f"文件为空: {file_path}")
+        # 计算总片数
+        total_slices = math.ceil(total_size / slice_size)
+
+        with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                await run_window(
+                    range(total_slices - 1),
+                    window,
+                    lambda seq: self.__upload_slice(view, seq, slice_size, session, retries),
+                )
+                # 服务端收到最后一片才会合并文件, 要等前面的分片都传完
+                await self.__upload_slice(view, total_slices - 1, slice_size, session, retries)
+            finally:
+                view.release()
+
+    async def __upload_slice(self, view: memoryview, seq: int, slice_size: int, session: str, retries: int):
+        total_size = len(view)
+        offset = seq * slice_size
+        end = min(offset + slice_size, total_size)
+        chunk = view[offset:end]
+        if len(chunk) >= _ENCODE_OFFLOAD:
+            data = (await asyncio.to_thread(base64.b64encode, chunk)).decode()
+        else:
+            data = base64.b64encode(chunk).decode()
+        chunk.release()
+
+        for retry in range(retries + 1):
+            if retry:
+                await asyncio.sleep(min(0.5 * 2 ** (retry - 1), 5))
+            try:
+                resp = await self.client.post(
                     "https://h5.qzone.qq.com/webapp/json/sliceUpload/FileUpload",
                     params={
                         "type": "json",
                         "total": total_size,
                         "seq": seq,
-                        "retry": 0,
+                        "retry": retry,
                         "offset": offset,
                         "end": end,
                         "g_tk": self.get_g_tk(),
@@ -341,36 +547,92 @@ class Qzone:
                         "data": data,
                         "end": end,
                         "offset": offset,
-                        "retry": 0,
+                        "retry": retry,
                         "seq": seq,
                         "session": session,
                         "slice_size": slice_size,
                         "uin": str(self.uin),
                     },
                 )
+            except httpx.TransportError as e:
+                error = repr(e)
+                continue
+            if resp.status_code == 200 and _slice_ok(resp):
+                return
+            error = f"[{resp.status_code}]{resp.text}"
+        raise RuntimeError(f"上传分片 {seq} 失败: {error}")
 
     async def upload_raw_image(
         self, album_name: str, file_path: list[str]
     ) -> list[str]:
+        """ 任意一张失败就抛出异常, 需要知道每张图片的结果请用 upload_raw_images """
+        result = await self.upload_raw_images(album_name, file_path)
+        for f in result.files:
+            if f.error != None:
+                raise f.error
+        return [f.name for f in result.files]
+
+    async def upload_raw_images(
+        self,
+        album_name: str,
+        files: list[str],
+        *,
+        concurrency: int = 3,
+        window: int = 4,
+        progress: Callable[[int, int, UploadedFile], Any] | None = None,
+    ) -> UploadResult:
+        """
+        批量上传原图, 一张失败不影响其他图片.
+        concurrency: 同时上传的图片数, window: 每张图片同时上传的分片数
+        progress: 每张图片结束时调用 progress(已完成数, 总数, UploadedFile), 可以是协程函数
+        """
         album_id = await self.get_album(album_name)
         if album_id == None:
             raise RuntimeError(f"相册 {album_name} 不存在")
 
-        names = []
+        results = [UploadedFile(path) for path in files]
         iBatchID = int(time.time() * 1e6)
-        for i, file in enumerate(file_path):
+        semaphore = asyncio.Semaphore(concurrency)
+        done = 0
+
+        async def upload(i: int):
+            nonlocal done
+            item = results[i]
             name = base64.b64encode(random.randbytes(16)).decode("utf-8")
-            names.append(name)
-            session = await self._get_session(
-                file_path=file,
-                album_id=album_id,
-                name=name,
-                index=i,
-                total=len(file_path),
-                iBatchID=iBatchID,
-            )
-            await self._upload_raw_image(file_path=file, session=session)
-        return names
+            try:
+                async with semaphore:
+                    session, slice_size = await self._get_session(
+                        file_path=item.path,
+                        album_id=album_id,
+                        name=name,
+                        index=i,
+                        total=len(files),
+                        iBatchID=iBatchID,
+                    )
+                    await self._upload_raw_image(
+                        file_path=item.path, session=session, slice_size=slice_size, window=window
+                    )
+                item.name = name
+                self.__photo_index.setdefault(album_id, _PhotoIndex()).dirty = True
+            except Exception as e:
+                item.error = e
+            done += 1
+            if progress != None:
+                # 回调出错不能影响其他图片的上传
+                try:
+                    r = progress(done, len(files), item)
+                    if inspect.isawaitable(r):
+                        await r
+                except Exception:
+                    logger.exception("progress 回调发生异常")
+
+        async with asyncio.TaskGroup() as tg:
+            for i in range(len(files) - 1):
+                tg.create_task(upload(i))
+        # 和分片一样, 批次里的最后一张放到最后传
+        if files:
+            await upload(len(files) - 1)
+        return UploadResult(results)
 
     async def get_feeds(self, page: int = 0, length: int = 10) -> list[Emotion]:
         resp = await self.client.get(
@@ -383,7 +645,7 @@ class Qzone:
                 "count": length,
             },
         )
-        data = load_resp(resp.text)
+        data = await load_resp_async(resp.text)
         if data["code"] != 0:
             logger.error(data)
             raise RuntimeError(data["message"])
@@ -399,7 +661,21 @@ class Qzone:
             )
         return emotions
 
+    def iter_feeds(self, page: int = 0, length: int = 10, pages: int | None = None) -> AsyncIterator[Emotion]:
+        """
+        从第 page 页开始逐条返回说说, 处理当前页时会预先请求下一页. 跨页重复的说说按 key 去掉.
+        pages 为 None 时一直翻到没有新说说为止
+        """
+        end = None if pages == None else page + pages
+        return iter_pages(
+            lambda p: self.get_feeds(p, length),
+            page,
+            lambda p, _: p + 1 if end == None or p + 1 < end else None,
+            lambda f: f.key,
+        )
+
     async def like(self, emotion: Emotion):
+        """ 服务端拒绝 (状态码不是 200, 或者 code / ret 不为 0) 时抛出 RuntimeError """
         resp = await self.client.post(
             "https://user.qzone.qq.com/proxy/domain/w.qzone.qq.com/cgi-bin/likes/internal_dolike_app",
             params={"g_tk": self.get_g_tk()},
@@ -407,6 +683,95 @@ class Qzone:
                 "unikey": f"http://user.qzone.qq.com/{emotion.uin}/mood/{emotion.key}",
             },
         )
+        if resp.status_code != 200:
+            raise RuntimeError(f"点赞失败[{resp.status_code}]:{resp.text}")
+        try:
+            data = load_resp(resp.text)
+        except ValueError:
+            raise RuntimeError(f"点赞失败[{resp.status_code}]:{resp.text}") from None
+        # 两个字段都可能出现, 比如 {"code": 0, "ret": -3000}, 任意一个不为 0 都是失败
+        if data.get("code", 0) != 0 or data.get("ret", 0) != 0:
+            raise RuntimeError(f"点赞失败[{resp.status_code}]:{resp.text}")
+
+    async def like_many(
+        self,
+        emotions: Iterable[Emotion] | AsyncIterable[Emotion],
+        *,
+        concurrency: int = 4,
+        interval: float = 0.2,
+    ) -> list[tuple[Emotion, Exception]]:
+        """
+        批量点赞, 可以直接传入 iter_feeds(). 最多同时 concurrency 个请求, 相邻两个请求至少间隔 interval 秒.
+        一个失败不影响其他, 返回失败的说说和异常
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        pace = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+        next_at = 0.0
+        failed = []
+
+        async def like(emotion: Emotion):
+            nonlocal next_at
+            try:
+                async with pace:
+                    delay = next_at - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    next_at = loop.time() + interval
+                await self.like(emotion)
+            except Exception as e:
+                failed.append((emotion, e))
+            finally:
+                semaphore.release()
+
+        async with asyncio.TaskGroup() as tg:
+            if isinstance(emotions, AsyncIterable):
+                async for emotion in emotions:
+                    await semaphore.acquire()
+                    tg.create_task(like(emotion))
+            else:
+                for emotion in emotions:
+                    await semaphore.acquire()
+                    tg.create_task(like(emotion))
+        return failed
+
+
+async def _read_chunks(data: bytes | str | os.PathLike | AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        view = memoryview(data)
+        for i in range(0, len(view), READ_SIZE):
+            yield view[i : i + READ_SIZE]
+    elif isinstance(data, (str, os.PathLike)):
+        with open(data, "rb") as f:
+            while chunk := await asyncio.to_thread(f.read, READ_SIZE):
+                yield chunk
+    else:
+        async for chunk in data:
+            yield chunk
+
+
+async def _form_stream(head: bytes, chunks: AsyncIterator[bytes], tail: bytes) -> AsyncIterator[bytes]:
+    yield head
+    # base64 每 3 个字节一组, 凑不满的留到下一块
+    carry = b""
+    async for chunk in chunks:
+        if carry:
+            chunk = carry + chunk
+        n = len(chunk) - len(chunk) % 3
+        if n:
+            yield base64.b64encode(chunk[:n])
+        carry = bytes(chunk[n:])
+    if carry:
+        yield base64.b64encode(carry)
+    yield tail
+
+
+def _slice_ok(resp: httpx.Response) -> bool:
+    # 以前不检查分片的响应, 解析不了的响应按成功处理
+    try:
+        return resp.json().get("ret", 0) == 0
+    except ValueError:
+        return True
 
 
 def get_len(file_path: str):
@@ -422,4 +787,12 @@ def get_md5(file_path: str):
 
 
 def load_resp(text: str) -> Any:
-    return demjson3.decode(text[text.find("{") : text.rfind("}") + 1])
+    """ 去掉 JSONP 的回调函数名后解析, 不是严格的 JSON 时按 JS 字面量解析 """
+    return jsonp.loads(text[text.find("{") : text.rfind("}") + 1])
+
+
+async def load_resp_async(text: str) -> Any:
+    """ 和 load_resp 相同, 响应较大时放到线程里解析, 不阻塞事件循环 """
+    if len(text) >= _DECODE_OFFLOAD:
+        return await asyncio.to_thread(load_resp, text)
+    return load_resp(text)
@@ -0,0 +1,49 @@
+import asyncio
+from typing import Awaitable, Callable
+
+
+class ReadReceipts:
+    """
+    合并已读回执: 每个会话在 window 秒内只标记最新的一条消息.
+    window 为 None 时不发送已读回执.
+    """
+
+    window: float | None
+    received: int
+    """ 收到的消息数 """
+    sent: int
+    """ 实际发送的回执数 """
+    __mark: Callable[[int], Awaitable]
+    __pending: dict[str, int]
+    __handle: asyncio.TimerHandle | None
+    __tasks: set[asyncio.Task]
+
+    def __init__(self, mark: Callable[[int], Awaitable], window: float | None = 1):
+        self.window = window
+        self.received = 0
+        self.sent = 0
+        self.__mark = mark
+        self.__pending = {}
+        self.__handle = None
+        self.__tasks = set()
+
+    def add(self, key: str, message_id: int):
+        if self.window == None:
+            return
+        self.received += 1
+        self.__pending[key] = message_id
+        if self.__handle == None:
+            self.__handle = asyncio.get_running_loop().call_later(
+                self.window, self.flush
+            )
+
+    def flush(self):
+        if self.__handle != None:
+            self.__handle.cancel()
+            self.__handle = None
+        pending, self.__pending = self.__pending, {}
+        for message_id in pending.values():
+            self.sent += 1
+            task = asyncio.create_task(self.__mark(message_id))
+            self.__tasks.add(task)
+            task.add_done_callback(self.__tasks.discard)
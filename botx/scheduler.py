@@ -0,0 +1,137 @@
+import asyncio
+import time
+
+# 只有发消息的 API 需要限速, 查询 / 已读等调用直接发送
+MESSAGE_ACTIONS = {
+    "send_msg",
+    "send_private_msg",
+    "send_group_msg",
+    "send_forward_msg",
+    "send_private_forward_msg",
+    "send_group_forward_msg",
+}
+
+
+class TokenBucket:
+    rate: float | None
+    """ 每秒生成的令牌数, None 表示不限速 """
+    capacity: float
+    tokens: float
+    waiting: int
+    """ 正在排队的调用数 """
+    acquired: int
+    wait_time: float
+    """ 累计等待时间(秒) """
+    __updated: float
+    __lock: asyncio.Lock
+
+    def __init__(self, rate: float | None, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.waiting = 0
+        self.acquired = 0
+        self.wait_time = 0
+        self.__updated = time.monotonic()
+        self.__lock = asyncio.Lock()
+
+    def __refill(self, now: float):
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.__updated) * self.rate
+        )
+        self.__updated = now
+
+    async def acquire(self):
+        if not self.rate:
+            self.acquired += 1
+            return
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            # Lock 是 FIFO 的, 同一个桶里的消息按提交顺序发出
+            async with self.__lock:
+                while True:
+                    self.__refill(time.monotonic())
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+        self.acquired += 1
+        self.wait_time += time.monotonic() - start
+
+    def idle(self) -> bool:
+        if self.waiting:
+            return False
+        if self.rate:
+            self.__refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.waiting,
+            "acquired": self.acquired,
+            "wait_time": self.wait_time,
+            "avg_wait": self.wait_time / self.acquired if self.acquired else 0,
+        }
+
+
+class Scheduler:
+    """
+    发送调度器, 每个目标(群 / 私聊)一个令牌桶, 再加上一个全局令牌桶.
+    刷屏的群只会在自己的桶里排队, 不会拖慢其他群的回复.
+    """
+
+    rate: float | None
+    burst: int
+    max_buckets: int
+    buckets: dict[str, TokenBucket]
+    global_bucket: TokenBucket
+
+    def __init__(
+        self,
+        rate: float | None = 10,
+        burst: int = 1,
+        *,
+        global_rate: float | None = None,
+        global_burst: int = 1,
+        max_buckets: int = 1024,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_buckets = max_buckets
+        self.buckets = {}
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+
+    @staticmethod
+    def target(action: str, params: dict | None) -> str | None:
+        if action not in MESSAGE_ACTIONS or not params:
+            return None
+        if params.get("group_id") != None:
+            return f"g{params["group_id"]}"
+        if params.get("user_id") != None:
+            return f"p{params["user_id"]}"
+        return None
+
+    async def acquire(self, action: str, params: dict | None = None):
+        key = self.target(action, params)
+        if key == None:
+            return
+        bucket = self.buckets.get(key)
+        if bucket == None:
+            if len(self.buckets) >= self.max_buckets:
+                self.__evict()
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+        await bucket.acquire()
+        await self.global_bucket.acquire()
+
+    def __evict(self):
+        # 满了的空闲桶和新建的桶没有区别, 可以直接丢掉
+        for key in [k for k, b in self.buckets.items() if b.idle()]:
+            del self.buckets[key]
+
+    def stats(self) -> dict[str, dict]:
+        stats = {k: b.stats() for k, b in self.buckets.items()}
+        stats["global"] = self.global_bucket.stats()
+        return stats
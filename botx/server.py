@@ -0,0 +1,289 @@
+import asyncio
+import hashlib
+import hmac
+from http import HTTPStatus
+from typing import Callable
+
+from httpx import AsyncClient
+from websockets.asyncio.server import ServerConnection, serve
+from websockets.http11 import Request, Response
+
+import botx.logging
+from botx.bot import AccessTokenError, Bot
+from botx.codec import Codec
+
+
+class Server:
+    """
+    反向 Websocket (OneBot 11 Universal), 一个进程接收多个 Onebot 实现的连接.
+    按 X-Self-ID 找到对应的 Bot, 找不到时调用 factory 创建.
+    """
+
+    host: str
+    port: int
+    log_level: str
+    __token: str | None
+    __factory: Callable[[int], Bot] | None
+    __bots: dict[int, Bot]
+    __connections: dict[int, tuple[ServerConnection, asyncio.Event]]
+
+    def __init__(
+        self,
+        host: str = "0.0.0.0",
+        port: int = 8080,
+        *,
+        token: str | None = None,
+        factory: Callable[[int], Bot] | None = None,
+        log_level="INFO",
+    ):
+        self.host = host
+        self.port = port
+        self.log_level = log_level
+        self.__token = token
+        self.__factory = factory
+        self.__bots = {}
+        self.__connections = {}
+
+    def add(self, self_id: int, bot: Bot):
+        self.__bots[self_id] = bot
+
+    def get(self, self_id: int) -> Bot | None:
+        return self.__bots.get(self_id)
+
+    async def start(self):
+        async with serve(
+            self.__handler,
+            self.host,
+            self.port,
+            process_request=self.__check,
+        ):
+            self.getLogger().info(f"反向 Websocket 监听于 {self.host}:{self.port}")
+            await asyncio.Future()
+
+    def __check(self, connection: ServerConnection, request: Request) -> Response | None:
+        if self.__token != None and not _check_token(request.headers.get("Authorization"), self.__token):
+            return connection.respond(HTTPStatus.UNAUTHORIZED, "Access Token 错误\n")
+        if request.headers.get("X-Client-Role", "Universal") != "Universal":
+            return connection.respond(HTTPStatus.BAD_REQUEST, "只支持 Universal 连接\n")
+        try:
+            self_id = int(request.headers["X-Self-ID"])
+        except (KeyError, ValueError):
+            return connection.respond(HTTPStatus.BAD_REQUEST, "缺少 X-Self-ID\n")
+        if self_id not in self.__bots:
+            if self.__factory == None:
+                return connection.respond(HTTPStatus.FORBIDDEN, "未知的账号\n")
+            self.__bots[self_id] = self.__factory(self_id)
+        return None
+
+    async def __handler(self, ws: ServerConnection):
+        self_id = int(ws.request.headers["X-Self-ID"])
+        bot = self.__bots[self_id]
+
+        # 同一个账号重连时先关掉旧连接, 等它收完尾再接手, 两个 sender 不能同时读一个队列
+        old = self.__connections.get(self_id)
+        if old != None:
+            await old[0].close()
+            await old[1].wait()
+        done = asyncio.Event()
+        self.__connections[self_id] = (ws, done)
+        self.getLogger().info(f"账号 {self_id} 已连接: {ws.remote_address}")
+        try:
+            await bot._serve(ws)
+        finally:
+            done.set()
+            if self.__connections.get(self_id, (None,))[0] is ws:
+                del self.__connections[self_id]
+
+    def getLogger(self):
+        return botx.logging.getLogger(name="Server", level=self.log_level)
+
+
+class HttpConnection:
+    """
+    把 HTTP API + HTTP POST 上报包装成和 Websocket 一样的 send / recv,
+    这样 Bot 不需要关心底层用的是哪种连接
+    """
+
+    api_uri: str
+    __bot: Bot
+    __token: str | None
+    __codec: Codec
+    __client: AsyncClient
+    __frames: asyncio.Queue
+    __tasks: set[asyncio.Task]
+
+    def __init__(self, api_uri: str, bot: Bot, *, token: str | None = None, client: AsyncClient | None = None):
+        self.api_uri = api_uri.rstrip("/")
+        self.__bot = bot
+        self.__token = token
+        self.__codec = bot.codec
+        self.__client = client or AsyncClient(timeout=60)
+        self.__frames = asyncio.Queue()
+        self.__tasks = set()
+
+    def feed(self, body: bytes) -> bool:
+        """ 收到一条 HTTP POST 上报, 不是事件时返回 False, 不交给 Bot """
+        try:
+            data = self.__codec.loads(body)
+        except ValueError:
+            return False
+        # 带 echo 的数据会被当成 API 的响应, 上报里不能有
+        if not isinstance(data, dict) or "post_type" not in data or "echo" in data:
+            return False
+        self.__frames.put_nowait(body)
+        return True
+
+    async def recv(self, decode: bool | None = None) -> bytes:
+        return await self.__frames.get()
+
+    async def send(self, payload: str | bytes, text: bool | None = None):
+        # 每个调用单独发请求, 不能让慢的 API 挡住后面的调用
+        frame = self.__codec.loads(payload)
+        task = asyncio.create_task(self.__call(frame))
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+    async def __call(self, frame: dict):
+        headers = {}
+        if self.__token != None:
+            headers["Authorization"] = f"Bearer {self.__token}"
+        try:
+            resp = await self.__client.post(
+                f"{self.api_uri}/{frame["action"]}",
+                json=frame["params"] or {},
+                headers=headers,
+            )
+            if resp.status_code == 401 or resp.status_code == 403:
+                data = {"status": "failed", "retcode": 1403, "data": None}
+            else:
+                data = resp.json()
+        except Exception as e:
+            # 和 Websocket 断开时一样, 让 call_api 抛出 ConnectionError
+            self.__bot._fail_call(frame["echo"], ConnectionError(f"调用 {frame["action"]} 失败: {e!r}"))
+            return
+        data["echo"] = frame["echo"]
+        self.__frames.put_nowait(self.__codec.dumps(data))
+
+
+class HttpServer:
+    """
+    HTTP POST 上报. Onebot 把事件 POST 到这里, API 通过 Onebot 的 HTTP 服务调用.
+    """
+
+    host: str
+    port: int
+    max_body: int
+    """ 上报的请求体最大字节数, 超过时返回 413 并断开连接 """
+    log_level: str
+    __secret: bytes | None
+    __bots: dict[int, tuple[Bot, HttpConnection]]
+
+    def __init__(
+        self,
+        host: str = "0.0.0.0",
+        port: int = 8080,
+        *,
+        secret: str | None = None,
+        max_body: int = 16 << 20,
+        log_level="INFO",
+    ):
+        self.host = host
+        self.port = port
+        self.max_body = max_body
+        self.log_level = log_level
+        self.__secret = secret.encode() if secret != None else None
+        self.__bots = {}
+
+    def add(
+        self,
+        self_id: int,
+        bot: Bot,
+        api_uri: str,
+        *,
+        token: str | None = None,
+        client: AsyncClient | None = None,
+    ):
+        """ api_uri 是 Onebot 的 HTTP 服务地址, token 为其 Access Token """
+        self.__bots[self_id] = (
+            bot,
+            HttpConnection(api_uri, bot, token=token, client=client),
+        )
+
+    async def start(self):
+        server = await asyncio.start_server(self.__handle, self.host, self.port)
+        self.getLogger().info(f"HTTP POST 监听于 {self.host}:{self.port}")
+        async with server, asyncio.TaskGroup() as tg:
+            for self_id, (bot, conn) in self.__bots.items():
+                tg.create_task(self.__serve(self_id, bot, conn))
+            tg.create_task(server.serve_forever())
+
+    async def __serve(self, self_id: int, bot: Bot, conn: HttpConnection):
+        try:
+            await bot._serve(conn, self_id=self_id)
+        except AccessTokenError:
+            self.getLogger().error(f"账号 {self_id} 的 Access Token 错误, 已停止")
+        except Exception:
+            self.getLogger().exception(f"账号 {self_id} 发生异常, 已停止")
+        finally:
+            # 只停掉这个账号, 之后它的上报一律拒绝
+            self.__bots.pop(self_id, None)
+
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, _, _ = line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (h := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    k, v = h.decode("latin-1").split(":", 1)
+                    headers[k.strip().lower()] = v.strip()
+                length = int(headers.get("content-length", -1))
+                if length < 0:
+                    status = HTTPStatus.LENGTH_REQUIRED
+                elif length > self.max_body:
+                    status = HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+                else:
+                    body = await reader.readexactly(length)
+                    status = self.__on_post(method, headers, body)
+                # 不支持快速操作, 直接返回空响应
+                writer.write(
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\nContent-Length: 0\r\n\r\n".encode()
+                )
+                await writer.drain()
+                # 没有读走的请求体还留在连接里, 只能断开
+                if headers.get("connection", "").lower() == "close" or status in (
+                    HTTPStatus.LENGTH_REQUIRED,
+                    HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                ):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def __on_post(self, method: str, headers: dict[str, str], body: bytes) -> HTTPStatus:
+        if method != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED
+        if self.__secret != None:
+            sign = "sha1=" + hmac.new(self.__secret, body, hashlib.sha1).hexdigest()
+            if not hmac.compare_digest(sign, headers.get("x-signature", "")):
+                return HTTPStatus.UNAUTHORIZED
+        try:
+            _, conn = self.__bots[int(headers["x-self-id"])]
+        except (KeyError, ValueError):
+            return HTTPStatus.FORBIDDEN
+        if not conn.feed(body):
+            return HTTPStatus.BAD_REQUEST
+        return HTTPStatus.NO_CONTENT
+
+    def getLogger(self):
+        return botx.logging.getLogger(name="HttpServer", level=self.log_level)
+
+
+def _check_token(header: str | None, token: str) -> bool:
+    if header == None:
+        return False
+    scheme, _, value = header.partition(" ")
+    return scheme.lower() in ("bearer", "token") and hmac.compare_digest(value, token)
@@ -0,0 +1,343 @@
+import asyncio
+import bisect
+import hashlib
+import inspect
+import multiprocessing
+import os
+import socket
+from typing import Awaitable, Callable
+
+import websockets
+
+import botx.logging
+from botx.bot import AccessTokenError, Bot
+from botx.codec import Codec, get_codec
+
+# 帧格式: 4 字节大端长度 + JSON
+_HEADER = 4
+# 调用失败的控制帧以这个字节开头, JSON 不会以它开头
+_FAILED = b"\x00"
+# 一个分片积压超过这么多字节时, 主进程等它消化后再继续读 Websocket
+_HIGH_WATER = 16 << 20
+
+
+class ShardedBot:
+    """
+    把一个账号的事件分给多个进程处理, 主进程只负责 Websocket 的收发.
+    按 group_id / user_id 做一致性哈希, 同一个群 / 私聊总是落在同一个进程里, 事件顺序不变.
+    每个进程里都有一个完整的 Bot, 处理函数里的 get_bot(), msg.reply(), call_api() 照常使用,
+    API 调用经主进程转发, 响应再按 echo 送回原来的进程.
+
+    setup 在每个子进程中被调用, 用来注册处理函数, 必须是模块级的函数 (子进程通过 spawn 启动).
+    """
+
+    ws_uri: str | None
+    shards: int
+    codec: Codec
+    log_level: str
+    __token: str | None
+    __setup: Callable[[Bot], None | Awaitable[None]]
+    __kwargs: dict
+    __ring: list[int]
+    __owners: list[int]
+    __workers: list["_Shard | None"]
+    __ws: object | None
+    __inflight: set[str]
+    __lifecycle: bytes | None
+    __routed: list[int]
+    __running: bool = False
+
+    def __init__(
+        self,
+        ws_uri: str | None = None,
+        setup: Callable[[Bot], None | Awaitable[None]] | None = None,
+        *,
+        shards: int | None = None,
+        token: str | None = None,
+        codec: str = "json",
+        replicas: int = 160,
+        log_level="INFO",
+        **kwargs,
+    ):
+        """
+        shards: 子进程数, 默认为 CPU 核数
+        codec: 主进程和子进程使用的 JSON 实现, 只能是名字, 见 botx.codec
+        replicas: 每个分片在哈希环上的虚拟节点数
+        kwargs: 传给子进程中 Bot 的参数, 见 Bot.__init__
+        """
+        if setup == None:
+            raise ValueError("需要指定 setup 来注册处理函数")
+        self.ws_uri = ws_uri
+        self.shards = shards or os.cpu_count() or 1
+        self.codec = get_codec(codec)
+        self.log_level = log_level
+        self.__token = token
+        self.__setup = setup
+        self.__kwargs = {**kwargs, "codec": codec, "log_level": log_level}
+        self.__ws = None
+        self.__inflight = set()
+        self.__lifecycle = None
+        self.__routed = [0] * self.shards
+        self.__workers = [None] * self.shards
+
+        points = sorted(
+            (_hash(f"{i}-{r}"), i)
+            for i in range(self.shards)
+            for r in range(replicas)
+        )
+        self.__ring = [p for p, _ in points]
+        self.__owners = [i for _, i in points]
+
+    def shard_of(self, key: str) -> int:
+        """ key 的格式和 Scheduler 一样: g<群号> / p<QQ号> """
+        i = bisect.bisect(self.__ring, _hash(key))
+        return self.__owners[i % len(self.__ring)]
+
+    async def start(self):
+        if self.ws_uri == None:
+            raise RuntimeError("没有指定 ws_uri, 请使用 botx.server 中的 Server 接收 Onebot 的连接")
+        if self.__running == True:
+            raise RuntimeError("该 Bot 实例已经被启动了!")
+        self.__running = True
+        self.getLogger().info(f"开始启动, 分片数: {self.shards}")
+
+        async for ws in websockets.connect(uri=self.ws_uri, additional_headers={"Authorization": f"Bearer {self.__token}"}):
+            self.getLogger().info(f"连接至 Onebot: {self.ws_uri}")
+            await self._serve(ws)
+            self.getLogger().warning("5s后将尝试重新连接...")
+            await asyncio.sleep(5)
+            self.getLogger().warning("尝试重新连接...")
+
+    async def _serve(self, ws, self_id: int | None = None):
+        """ 和 Bot._serve 一样, 可以直接交给 botx.server 使用 """
+        await self.__spawn_all()
+        self.__ws = ws
+        if self_id != None:
+            self.__lifecycle = self.codec.dumps(
+                {"post_type": "meta_event", "meta_event_type": "lifecycle", "sub_type": "connect", "self_id": self_id}
+            )
+            await self.__broadcast(self.__lifecycle)
+        try:
+            await self.__receiver(ws)
+        except websockets.ConnectionClosed:
+            self.getLogger().error("与 Onebot 的连接断开")
+        finally:
+            self.__ws = None
+            self.__fail_inflight()
+
+    async def __receiver(self, ws):
+        while True:
+            raw = await ws.recv(decode=False)
+            data: dict = self.codec.loads(raw)
+            if "echo" in data:
+                if data["retcode"] == 1403:
+                    # 和 Bot 一样交给 start / botx.server 处理, 已经发出的调用在 _serve 里统一失败
+                    raise AccessTokenError("Access Token 错误")
+                echo = str(data["echo"])
+                if echo not in self.__inflight:
+                    self.getLogger().debug(f"Onebot 发送了无效的 echo: {echo}")
+                    continue
+                self.__inflight.discard(echo)
+                i, _, data["echo"] = echo.partition(":")
+                await self.__forward(int(i), self.codec.dumps(data))
+            elif data["post_type"] == "meta_event":
+                # 心跳和连接事件每个进程都要知道
+                if data["meta_event_type"] == "lifecycle":
+                    self.__lifecycle = raw
+                await self.__broadcast(raw)
+            else:
+                i = self.shard_of(_key(data))
+                self.__routed[i] += 1
+                # 事件原样转发, 不需要重新编码
+                await self.__forward(i, raw)
+
+    async def __forward(self, i: int, frame: str | bytes):
+        shard = self.__workers[i]
+        if shard == None:
+            self.getLogger().warning(f"分片 {i} 不可用, 丢弃数据")
+            return
+        await shard.write(frame)
+
+    async def __broadcast(self, frame: str | bytes):
+        for i in range(self.shards):
+            await self.__forward(i, frame)
+
+    async def __pump(self, i: int, shard: "_Shard"):
+        """ 把子进程的 API 调用转发给 Onebot """
+        while True:
+            try:
+                data: dict = self.codec.loads(await shard.read())
+            except (EOFError, ConnectionError):
+                break
+            echo = f"{i}:{data["echo"]}"
+            if self.__ws == None:
+                await shard.write(_failed(data["echo"]))
+                continue
+            self.__inflight.add(echo)
+            try:
+                await self.__ws.send(self.codec.dumps({**data, "echo": echo}), text=True)
+            except websockets.ConnectionClosed:
+                # 断线由 _serve 处理, 这里只让这次调用失败
+                self.__inflight.discard(echo)
+                await shard.write(_failed(data["echo"]))
+        if self.__workers[i] is shard:
+            await self.__restart(i, shard)
+
+    async def __restart(self, i: int, shard: "_Shard"):
+        self.__workers[i] = None
+        await asyncio.to_thread(shard.process.join)
+        self.getLogger().error(f"分片 {i} 已退出 (exitcode={shard.process.exitcode}), 1s后重启")
+        self.__inflight = {e for e in self.__inflight if not e.startswith(f"{i}:")}
+        await asyncio.sleep(1)
+        await self.__spawn(i)
+        if self.__lifecycle != None:
+            await self.__forward(i, self.__lifecycle)
+
+    async def __spawn_all(self):
+        # 只在第一次连接时启动, 之后退出的分片由 __pump 重启
+        if any(s != None for s in self.__workers):
+            return
+        for i in range(self.shards):
+            await self.__spawn(i)
+
+    async def __spawn(self, i: int):
+        parent, child = socket.socketpair()
+        process = multiprocessing.get_context("spawn").Process(
+            target=_run_worker,
+            args=(i, child, self.__setup, self.__kwargs),
+            name=f"botx-shard-{i}",
+            daemon=True,
+        )
+        process.start()
+        child.close()
+        reader, writer = await asyncio.open_connection(sock=parent)
+        writer.transport.set_write_buffer_limits(high=_HIGH_WATER)
+        shard = _Shard(process, reader, writer)
+        self.__workers[i] = shard
+        asyncio.create_task(self.__pump(i, shard))
+
+    def __fail_inflight(self):
+        # 和 Bot 断线时一样, 已经发出去的调用不会再有响应了
+        for echo in self.__inflight:
+            i, _, orig = echo.partition(":")
+            shard = self.__workers[int(i)]
+            if shard != None:
+                shard.write_nowait(_failed(orig))
+        self.__inflight.clear()
+
+    def stats(self) -> dict:
+        return {
+            "shards": self.shards,
+            "alive": sum(1 for s in self.__workers if s != None and s.alive()),
+            "routed": list(self.__routed),
+            "inflight": len(self.__inflight),
+        }
+
+    def getLogger(self):
+        return botx.logging.getLogger(name="Shard", level=self.log_level)
+
+
+class _Shard:
+    process: multiprocessing.Process
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+
+    def __init__(self, process, reader, writer):
+        self.process = process
+        self.reader = reader
+        self.writer = writer
+
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    async def read(self) -> bytes:
+        return await _read_frame(self.reader)
+
+    def write_nowait(self, frame: str | bytes):
+        if isinstance(frame, str):
+            frame = frame.encode()
+        self.writer.write(len(frame).to_bytes(_HEADER, "big") + frame)
+
+    async def write(self, frame: str | bytes):
+        try:
+            self.write_nowait(frame)
+            await self.writer.drain()
+        except ConnectionError:
+            # 子进程已经退出, 由 __pump 负责重启
+            pass
+
+
+class _PipeConnection:
+    """ 子进程这一侧, 对 Bot 来说就是一个 Websocket """
+
+    __bot: Bot
+    __reader: asyncio.StreamReader
+    __writer: asyncio.StreamWriter
+
+    def __init__(self, bot: Bot, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.__bot = bot
+        self.__reader = reader
+        self.__writer = writer
+
+    async def recv(self, decode: bool | None = None) -> bytes:
+        while True:
+            frame = await _read_frame(self.__reader)
+            if not frame.startswith(_FAILED):
+                return frame
+            # 和不分片时一样, 连接断开时 call_api 抛出 ConnectionError
+            self.__bot._fail_call(frame[len(_FAILED):].decode(), ConnectionError("与 Onebot 的连接断开"))
+
+    async def send(self, payload: str | bytes, text: bool | None = None):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.__writer.write(len(payload).to_bytes(_HEADER, "big") + payload)
+        await self.__writer.drain()
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> bytes:
+    try:
+        size = int.from_bytes(await reader.readexactly(_HEADER), "big")
+        return await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        raise EOFError("分片连接已关闭")
+
+
+def _hash(key: str) -> int:
+    # crc32 对 "g100", "g101" 这种相近的 key 分布很差
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+def _key(data: dict) -> str:
+    if data.get("group_id"):
+        return f"g{data["group_id"]}"
+    if data["post_type"] == "message_sent" and data.get("target_id"):
+        # 自己发的私聊消息, user_id 是自己
+        return f"p{data["target_id"]}"
+    return f"p{data.get("user_id")}"
+
+
+def _failed(echo) -> bytes:
+    """ 调用没能送到 Onebot, 子进程收到后让这次调用抛出 ConnectionError """
+    return _FAILED + str(echo).encode()
+
+
+def _run_worker(index: int, sock: socket.socket, setup: Callable, kwargs: dict):
+    try:
+        asyncio.run(_worker(index, sock, setup, kwargs))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker(index: int, sock: socket.socket, setup: Callable, kwargs: dict):
+    bot = Bot(**kwargs)
+    if inspect.iscoroutinefunction(setup):
+        await setup(bot)
+    else:
+        setup(bot)
+    reader, writer = await asyncio.open_connection(sock=sock)
+    bot.getLogger().debug(f"分片 {index} 已启动")
+    try:
+        await bot._serve(_PipeConnection(bot, reader, writer))
+    except* (EOFError, ConnectionError):
+        # 主进程退出了
+        pass